@@ -5,16 +5,21 @@ if 'test' not in __import__('sys').argv[0]: # pragma: no cover
     import gevent.monkey
     gevent.monkey.patch_all()
 import os
-import simplejson
 from logging import getLogger
 from libnacl.sign import Signer, Verifier
 from pyramid.authorization import ACLAuthorizationPolicy as AuthorizationPolicy
 from pyramid.config import Configurator
-from pyramid.renderers import JSON, JSONP
 from pyramid.settings import asbool
 
 from openregistry.api.auth import AuthenticationPolicy, authenticated_role, check_accreditation
-from openregistry.api.database import set_api_security
+from openregistry.api.cache import DocumentCache
+from openregistry.api.changes import ChangesWatcher
+from openregistry.api.codec import DEFAULT_CODEC, get_codec
+from openregistry.api.database import set_api_security, Server
+from openregistry.api.renderers import CHUNK_SIZE, StreamingJSON, StreamingJSONP
+from openregistry.api.replicas import ReplicaRouter, read_db
+from openregistry.api.revisions import RevisionStore
+from openregistry.api.transport import couchdb_session
 from openregistry.api.utils import forbidden, request_params, load_plugins, json_body, couchdb_json_decode
 from openregistry.api.constants import ROUTE_PREFIX
 
@@ -22,10 +27,17 @@ LOGGER = getLogger("{}.init".format(__name__))
 
 
 def main(global_config, **settings):
+    authentication_policy = AuthenticationPolicy(
+        settings['auth.file'], __name__,
+        cache_size=int(settings.get('auth.cache_size', 10000)),
+        cache_ttl=float(settings.get('auth.cache_ttl', 60)),
+    )
+    if float(settings.get('auth.reload_interval', 10)):
+        authentication_policy.watch(float(settings.get('auth.reload_interval', 10)))
     config = Configurator(
         autocommit=True,
         settings=settings,
-        authentication_policy=AuthenticationPolicy(settings['auth.file'], __name__),
+        authentication_policy=authentication_policy,
         authorization_policy=AuthorizationPolicy(),
         route_prefix=ROUTE_PREFIX,
     )
@@ -36,10 +48,14 @@ def main(global_config, **settings):
     config.add_request_method(authenticated_role, reify=True)
     config.add_request_method(check_accreditation)
     config.add_request_method(json_body, 'json_body', reify=True)
-    config.add_renderer('json', JSON(serializer=simplejson.dumps))
-    config.add_renderer('prettyjson', JSON(indent=4, serializer=simplejson.dumps))
-    config.add_renderer('jsonp', JSONP(param_name='opt_jsonp', serializer=simplejson.dumps))
-    config.add_renderer('prettyjsonp', JSONP(indent=4, param_name='opt_jsonp', serializer=simplejson.dumps))
+    config.add_request_method(read_db, 'read_db', reify=True)
+    config.registry.json_codec = codec = get_codec(settings.get('json.codec', DEFAULT_CODEC))
+    chunk_size = int(settings.get('renderer.chunk_size', CHUNK_SIZE))
+    config.add_renderer('json', StreamingJSON(codec=codec, chunk_size=chunk_size))
+    config.add_renderer('prettyjson', StreamingJSON(indent=4, codec=codec, chunk_size=chunk_size))
+    config.add_renderer('jsonp', StreamingJSONP(param_name='opt_jsonp', codec=codec, chunk_size=chunk_size))
+    config.add_renderer('prettyjsonp', StreamingJSONP(indent=4, param_name='opt_jsonp', codec=codec,
+                                                      chunk_size=chunk_size))
 
     # search for plugins
     plugins = settings.get('plugins') and settings['plugins'].split(',')
@@ -51,7 +67,19 @@ def main(global_config, **settings):
     if aserver:
         config.registry.admin_couchdb_server = aserver
     config.registry.db = db
-    couchdb_json_decode()
+    replicas = settings.get('couchdb.replicas', '').split()
+    if replicas:
+        replica_dbs = []
+        for url in replicas:
+            replica_server = Server(url, session=couchdb_session(settings))
+            replica_dbs.append((replica_server, replica_server[db.name]))
+        config.registry.replica_router = ReplicaRouter(
+            replica_dbs,
+            float(settings.get('health_threshold', 512)),
+            float(settings.get('couchdb.replicas_check_interval', 5)),
+        )
+        config.registry.replica_router.start()
+    couchdb_json_decode(codec)
 
     # Document Service key
     config.registry.docservice_url = settings.get('docservice_url')
@@ -80,4 +108,25 @@ def main(global_config, **settings):
     config.registry.health_threshold = float(settings.get('health_threshold', 512))
     config.registry.health_threshold_func = settings.get('health_threshold_func', 'all')
     config.registry.update_after = asbool(settings.get('update_after', True))
+    config.registry.longpoll_timeout = float(settings.get('longpoll_timeout', 30))
+    if int(settings.get('document_cache.entries', 1000)):
+        config.registry.document_cache = DocumentCache(
+            int(settings.get('document_cache.entries', 1000)),
+            int(settings.get('document_cache.size', 64 * 1024 * 1024)),
+            settings.get('document_cache.validate', 'head'),
+        )
+    feed_timeout = int(config.registry.longpoll_timeout)
+    if settings.get('couchdb.timeout'):
+        # feed requests must be answered before the socket times out
+        feed_timeout = max(min(feed_timeout, int(float(settings['couchdb.timeout'])) - 1), 1)
+    if int(settings.get('revisions.window', 0)):
+        config.registry.revision_store = RevisionStore(
+            db,
+            int(settings['revisions.window']),
+            int(settings.get('revisions.segment_size', 100)),
+            int(settings.get('revisions.snapshot_interval', 0)),
+        )
+    config.registry.changes_watcher = ChangesWatcher(db, feed_timeout, config.registry)
+    if asbool(settings.get('changes_feed', True)):
+        config.registry.changes_watcher.start()
     return config.make_wsgi_app()
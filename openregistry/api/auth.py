@@ -1,41 +1,118 @@
 # -*- coding: utf-8 -*-
 import binascii
+import os
 from hashlib import sha512
+from logging import getLogger
 from ConfigParser import ConfigParser
+from gevent import spawn, sleep
 from pyramid.authentication import BasicAuthAuthenticationPolicy, b64decode
 
+from openregistry.api.cache import TTLCache
+from openregistry.api.utils import json_body_lookup
+
+LOGGER = getLogger(__name__)
+
+
+def load_users(auth_file):
+    """ Parses auth file into users index keyed by sha512 of their tokens """
+    config = ConfigParser()
+    if not config.read(auth_file):
+        raise IOError('Unable to read {}'.format(auth_file))
+    users = {}
+    for i in config.sections():
+        users.update(dict([
+            (
+                k.split(',', 1)[0],
+                {
+                    'name': j,
+                    'level': k.split(',', 1)[1] if ',' in k else '1234',
+                    'group': i
+                }
+            )
+            for j, k in config.items(i)
+        ]))
+    return users
+
 
 class AuthenticationPolicy(BasicAuthAuthenticationPolicy):
-    def __init__(self, auth_file, realm='OpenRegistry', debug=False):
+    def __init__(self, auth_file, realm='OpenRegistry', debug=False, cache_size=10000, cache_ttl=60):
         self.realm = realm
         self.debug = debug
-        config = ConfigParser()
-        config.read(auth_file)
-        self.users = {}
-        for i in config.sections():
-            self.users.update(dict([
-                (
-                    k.split(',', 1)[0],
-                    {
-                        'name': j,
-                        'level': k.split(',', 1)[1] if ',' in k else '1234',
-                        'group': i
-                    }
-                )
-                for j, k in config.items(i)
-            ]))
+        self.auth_file = auth_file
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.mtime = self.get_mtime()
+        self.set_users(load_users(auth_file) if self.mtime else {})
+        self._watcher = None
+
+    def set_users(self, users):
+        """ Swaps users index together with caches built from the previous one """
+        # Authorization header -> user (False for unknown credentials)
+        self.users_cache = TTLCache(self.cache_size, self.cache_ttl)
+        # access token -> its sha512 hexdigest
+        self.tokens_cache = TTLCache(self.cache_size, self.cache_ttl)
+        self.users = users
+
+    def get_mtime(self):
+        try:
+            return os.stat(self.auth_file).st_mtime
+        except OSError:
+            return None
+
+    def reload(self):
+        """ Reloads users if auth file has been modified, returns True on reload """
+        mtime = self.get_mtime()
+        if mtime is None or mtime == self.mtime:
+            return False
+        try:
+            users = load_users(self.auth_file)
+        except Exception as e:
+            LOGGER.error('Error on reloading auth file {}: {}'.format(self.auth_file, e),
+                         extra={'MESSAGE_ID': 'auth_reload_error'})
+            return False
+        self.mtime = mtime
+        self.set_users(users)
+        LOGGER.info('Reloaded auth file {}: {} users'.format(self.auth_file, len(users)),
+                    extra={'MESSAGE_ID': 'auth_reload'})
+        return True
+
+    def _watch(self, interval):
+        while True:
+            sleep(interval)
+            self.reload()
+
+    def watch(self, interval):
+        """ Starts polling auth file for changes every ``interval`` seconds """
+        if self._watcher is None or self._watcher.dead:
+            self._watcher = spawn(self._watch, interval)
+
+    def get_user(self, request):
+        """ The user the request is authorized as, resolved once per request """
+        user = getattr(request, 'auth_user', None)
+        if user is None:
+            authorization = request.headers.get('Authorization')
+            user = self.users_cache.get(authorization) if authorization else False
+            if user is None:
+                token = self._get_credentials(request)
+                user = token and self.users.get(sha512(token).hexdigest()) or False
+                self.users_cache.set(authorization, user)
+            request.auth_user = user
+        return user or None
+
+    def hash_token(self, token):
+        token_sha512 = self.tokens_cache.get(token)
+        if token_sha512 is None:
+            token_sha512 = sha512(token).hexdigest()
+            self.tokens_cache.set(token, token_sha512)
+        return token_sha512
 
     def unauthenticated_userid(self, request):
         """ The userid parsed from the ``Authorization`` request header."""
-        token = self._get_credentials(request)
-        if token:
-            toket_sha512 = sha512(token).hexdigest()
-            user = self.users.get(toket_sha512)
-            if user:
-                return user['name']
+        user = self.get_user(request)
+        if user:
+            return user['name']
 
-    @staticmethod
-    def check(user, request):
+    def check(self, user, request):
         token = request.params.get('acc_token')
         auth_groups = ['g:{}'.format(user['group'])]
         for i in user['level']:
@@ -43,27 +120,27 @@ class AuthenticationPolicy(BasicAuthAuthenticationPolicy):
         if not token:
             token = request.headers.get('X-Access-Token')
             if not token:
-                if request.method in ['POST', 'PUT', 'PATCH'] and request.content_type == 'application/json':
-                    try:
-                        json = request.json_body
-                    except ValueError:
-                        json = None
-                    token = isinstance(json, dict) and json.get('access', {}).get('token')
+                if request.method in ['POST', 'PUT', 'PATCH']:
+                    json = json_body_lookup(request, 'access')
+                    token = json and json.get('access', {}).get('token')
                 if not token:
                     return auth_groups
-        auth_groups.append('{}_{}'.format(user['name'], sha512(token).hexdigest()))
+        auth_groups.append('{}_{}'.format(user['name'], self.hash_token(token)))
         return auth_groups
 
     def callback(self, username, request):
-        # Username arg is ignored.  Unfortunately _get_credentials winds up
-        # getting called twice when authenticated_userid is called.  Avoiding
-        # that, however, winds up duplicating logic from the superclass.
-        token = self._get_credentials(request)
-        if token:
-            toket_sha512 = sha512(token).hexdigest()
-            user = self.users.get(toket_sha512)
-            if user:
-                return self.check(user, request)
+        # Username arg is ignored, the user is resolved once per request.
+        user = self.get_user(request)
+        if user:
+            return self.check(user, request)
+
+    def effective_principals(self, request):
+        """ Principals are computed once per request, callers get a copy """
+        principals = getattr(request, 'auth_principals', None)
+        if principals is None:
+            principals = request.auth_principals = tuple(
+                super(AuthenticationPolicy, self).effective_principals(request))
+        return list(principals)
 
     @staticmethod
     def _get_credentials(request):
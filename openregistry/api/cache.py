@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from time import time
+from couchdb.client import Document
+from couchdb.http import ResourceNotFound
+
+
+class LRUCache(object):
+    """
+    Least recently used cache bounded by number of entries and by total
+    size of values as reported on ``set``.
+    """
+
+    def __init__(self, max_entries=1000, max_size=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        try:
+            value, size = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data[key] = (value, size)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, size=0):
+        self.pop(key)
+        if self.max_size and size > self.max_size:
+            return
+        self._data[key] = (value, size)
+        self.size += size
+        while len(self._data) > self.max_entries or (self.max_size and self.size > self.max_size):
+            _, (_, evicted_size) = self._data.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        try:
+            value, size = self._data.pop(key)
+        except KeyError:
+            return default
+        self.size -= size
+        return value
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': float(self.hits) / requests if requests else None,
+        }
+
+
+class TTLCache(LRUCache):
+    """ LRU cache whose entries expire ``ttl`` seconds after ``set`` """
+
+    def __init__(self, max_entries=1000, ttl=60):
+        super(TTLCache, self).__init__(max_entries)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        entry = super(TTLCache, self).get(key)
+        if entry is None:
+            return default
+        value, expires = entry
+        if expires <= time():
+            self.pop(key)
+            self.hits -= 1
+            self.misses += 1
+            return default
+        return value
+
+    def set(self, key, value, size=0):
+        super(TTLCache, self).set(key, (value, time() + self.ttl), size)
+
+
+class DocumentCache(LRUCache):
+    """
+    Cache of raw decoded CouchDB documents keyed by ``_id``.
+
+    Entries keep the ``_rev`` of the document and are checked with a ``HEAD``
+    request (ETag is the current revision) before use unless the caller
+    trusts the changes feed to invalidate them in time.
+    Cached documents are shared, so only shallow copies are handed out and
+    nested values must not be modified in place.
+    """
+
+    def __init__(self, max_entries=1000, max_size=None, validate='head'):
+        super(DocumentCache, self).__init__(max_entries, max_size)
+        self.validate = validate
+        self.stale = 0
+
+    @staticmethod
+    def get_rev(db, doc_id):
+        try:
+            _, headers, _ = db.resource.head(doc_id)
+        except ResourceNotFound:
+            return None
+        return headers.get('ETag', '').strip('"')
+
+    def load(self, db, doc_id, trusted=False):
+        """ Returns document by id or None if there is no such document """
+        entry = self.get(doc_id)
+        if entry is not None:
+            db_name, rev, doc = entry
+            if db_name == db.name and ((trusted and self.validate == 'changes') or rev == self.get_rev(db, doc_id)):
+                return Document(doc)
+            self.pop(doc_id)
+            self.stale += 1
+        try:
+            _, headers, doc = db.resource.get_json(doc_id)
+        except ResourceNotFound:
+            return None
+        self.set(doc_id, (db.name, doc['_rev'], doc), int(headers.get('Content-Length') or 0))
+        return Document(doc)
+
+    def invalidate(self, doc_id, rev=None):
+        """ Drops cached document unless it is already at ``rev`` """
+        if doc_id in self._data and (rev is None or self._data[doc_id][0][1] != rev):
+            self.pop(doc_id)
+
+    def stats(self):
+        stats = super(DocumentCache, self).stats()
+        stats['stale'] = self.stale
+        if stats['hit_ratio'] is not None:
+            stats['hit_ratio'] = float(self.hits - self.stale) / (self.hits + self.misses)
+        return stats
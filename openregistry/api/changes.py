@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+from logging import getLogger
+from random import random
+from time import time
+from gevent import spawn, sleep
+from gevent.event import Event
+
+from openregistry.api.events import DatabaseChangesEvent
+
+LOGGER = getLogger(__name__)
+
+
+def seq_number(seq):
+    """
+    Number of the update sequence: CouchDB 1.x seqs are numbers, 2.x seqs
+    are opaque strings starting with the number and a dash.
+    """
+    if isinstance(seq, basestring):
+        number = seq.split('-', 1)[0]
+        return int(number) if number.isdigit() else None
+    return seq
+
+
+class ChangesWatcher(object):
+    """
+    Follows the database ``_changes`` feed with a single longpoll loop per
+    worker. Every batch of changes is published on the registry as
+    ``DatabaseChangesEvent`` and then all requests waiting for new sequence
+    numbers are woken up. Failed polls are retried with exponential backoff.
+    """
+
+    def __init__(self, db, timeout=60, registry=None, backoff=0.5, max_backoff=30):
+        self.db = db
+        self.timeout = timeout
+        self.registry = registry
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.last_seq = None
+        self.last_poll = None
+        self.last_change = None
+        self.errors = 0
+        self.failures = 0
+        self._event = Event()
+        self._greenlet = None
+
+    @property
+    def running(self):
+        return self._greenlet is not None and not self._greenlet.dead
+
+    def start(self):
+        """ Starts following the feed if needed, returns last known seq """
+        if not self.running:
+            self.last_seq = self.db.info()['update_seq']
+            self._greenlet = spawn(self._run)
+        return self.last_seq
+
+    def stop(self):
+        if self._greenlet is not None:
+            self._greenlet.kill()
+            self._greenlet = None
+
+    def _run(self):
+        while True:
+            try:
+                changes = self.db.changes(feed='longpoll', since=self.last_seq,
+                                          timeout=self.timeout * 1000)
+            except Exception as e:
+                self.errors += 1
+                self.failures += 1
+                delay = min(self.backoff * 2 ** (self.failures - 1), self.max_backoff)
+                delay *= 0.5 + random() / 2
+                LOGGER.warning('Error on following changes feed: {}, reconnecting in {:.2f}s'.format(e, delay),
+                               extra={'MESSAGE_ID': 'changes_feed_error'})
+                sleep(delay)
+                continue
+            self.failures = 0
+            self.last_poll = time()
+            if changes['results']:
+                self.last_change = self.last_poll
+                self.publish(changes['results'], changes['last_seq'])
+            if changes['last_seq'] != self.last_seq:
+                self.notify(changes['last_seq'])
+
+    def publish(self, results, last_seq):
+        if self.registry is None:
+            return
+        try:
+            self.registry.notify(DatabaseChangesEvent(self.registry, results, last_seq))
+        except Exception as e:
+            LOGGER.exception('Error on processing database changes: {}'.format(e),
+                             extra={'MESSAGE_ID': 'changes_feed_subscriber_error'})
+
+    def notify(self, seq):
+        self.last_seq = seq
+        event, self._event = self._event, Event()
+        event.set()
+
+    def wait(self, since, timeout):
+        """
+        Blocks until the feed passes ``since`` sequence number.
+        Returns False if nothing has changed within ``timeout`` seconds.
+        Sequences with the same number are waited on, as 2.x ones can not be
+        ordered otherwise.
+        """
+        last, since = seq_number(self.start()), seq_number(since)
+        if since is None or (last is not None and last > since):
+            return True
+        return self._event.wait(timeout)
+
+    def stats(self):
+        """ Follower state and its lag behind the database """
+        update_seq = self.db.info()['update_seq']
+        update_number, last_number = seq_number(update_seq), seq_number(self.last_seq)
+        now = time()
+        return {
+            'running': self.running,
+            'last_seq': self.last_seq,
+            'update_seq': update_seq,
+            'lag': update_number - last_number if update_number is not None and last_number is not None else None,
+            'since_last_poll': now - self.last_poll if self.last_poll else None,
+            'since_last_change': now - self.last_change if self.last_change else None,
+            'errors': self.errors,
+            'failures': self.failures,
+        }
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+JSON codecs for request bodies, responses and CouchDB documents.
+
+Every codec parses numbers with a fraction or exponent into ``Decimal`` and
+writes ``Decimal`` values back as they are, so amounts never pass through
+floats. Responses are written ASCII-only, documents keep non-ASCII characters.
+The ``json.codec`` setting selects a codec from ``CODECS`` by name or a codec
+class by its dotted name.
+"""
+from decimal import Decimal
+from pyramid.path import DottedNameResolver
+import simplejson
+
+DEFAULT_CODEC = 'simplejson'
+
+
+class SimpleJSONCodec(object):
+    """ simplejson with its C speedups, encoders and decoder are built once """
+
+    name = 'simplejson'
+
+    def __init__(self):
+        self.decoder = simplejson.JSONDecoder(parse_float=Decimal)
+        self.response_encoder = simplejson.JSONEncoder()
+        self.document_encoder = simplejson.JSONEncoder(allow_nan=False, ensure_ascii=False)
+
+    def loads(self, text):
+        return self.decoder.decode(text)
+
+    def encoder(self, default=None):
+        """ Function encoding responses, ``default`` converts unknown objects """
+        if default is None:
+            return self.response_encoder.encode
+        return simplejson.JSONEncoder(default=default).encode
+
+    def iterencoder(self, default=None, **kw):
+        """ Function encoding responses in pieces with ``simplejson.dumps`` options such as ``indent`` """
+        return simplejson.JSONEncoder(default=default, **kw).iterencode
+
+    def dumps(self, value, default=None):
+        """ Same as ``simplejson.dumps(value, default=default)`` """
+        return self.encoder(default)(value)
+
+    def dumps_document(self, value):
+        return self.document_encoder.encode(value)
+
+
+CODECS = {
+    SimpleJSONCodec.name: SimpleJSONCodec,
+}
+
+
+def get_codec(name=DEFAULT_CODEC):
+    factory = CODECS.get(name) or DottedNameResolver().resolve(name)
+    return factory()
+
+
+default_codec = get_codec()
+
+
+def registry_codec(registry):
+    """ Codec of the application, the default one if it is not configured """
+    return getattr(registry, 'json_codec', None) or default_codec
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+from bisect import bisect_left
+from functools import partial
 from pkg_resources import get_distribution
 from logging import getLogger
 import os
@@ -28,6 +30,144 @@ def read_json(name):
     return loads(data)
 
 
+def read_codes(name, field=None):
+    """ Codes from a JSON list or from ``field`` of items of its ``data`` """
+    data = read_json(name)
+    return [i[field] for i in data['data']] if field else data
+
+
+def loaded_first(name, changes=False):
+    """ ``list`` method ``name`` run after codes (of arguments too) are loaded """
+    method = getattr(list, name)
+
+    def wrapper(self, *args):
+        self.load()
+        for i in args:
+            if isinstance(i, CodeList):
+                i.load()
+        if changes:
+            self.reset()
+        return method(self, *args)
+    wrapper.__name__ = name
+    return wrapper
+
+
+class CodeList(list):
+    """
+    List of codes with constant time membership tests, usable as schematics
+    ``choices``.
+
+    ``codes`` may be a callable, then codes are loaded on first use instead of
+    at import time: until then the list is assumed to be non-empty. Python
+    level operations load codes first, C functions reading list items
+    directly (such as ``str.join``) need an explicit ``load()``.
+    """
+
+    def __init__(self, codes=()):
+        super(CodeList, self).__init__()
+        self._loader = codes if callable(codes) else None
+        self._set = None
+        if self._loader is None:
+            list.extend(self, codes)
+
+    @property
+    def loaded(self):
+        return self._loader is None
+
+    def load(self):
+        if self._loader is not None:
+            loader, self._loader = self._loader, None
+            list.extend(self, loader())
+        return self
+
+    def reset(self):
+        """ Drops indexes of codes, called on changes """
+        self._set = None
+
+    def __contains__(self, code):
+        if self._set is None:
+            self._set = frozenset(self.load())
+        try:
+            return code in self._set
+        except TypeError:  # unhashable values are never codes
+            return False
+
+    def __nonzero__(self):
+        return not self.loaded or bool(len(self))
+
+    def __radd__(self, other):
+        if not isinstance(other, list):
+            return NotImplemented
+        return list.__add__(other, self.load())
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return type(self), (list(self),)
+
+
+for _name in ('__iter__', '__reversed__', '__len__', '__getitem__', '__getslice__', '__add__', '__mul__', '__rmul__',
+              '__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__', '__repr__', 'index', 'count'):
+    setattr(CodeList, _name, loaded_first(_name))
+for _name in ('__setitem__', '__delitem__', '__setslice__', '__delslice__', '__iadd__', '__imul__',
+              'append', 'extend', 'insert', 'pop', 'remove', 'reverse', 'sort'):
+    setattr(CodeList, _name, loaded_first(_name, changes=True))
+
+
+class ClassificationCodes(CodeList):
+    """
+    CPV-like classification codes with a hierarchical index.
+
+    Codes are ``NNNNNNNN-C``: two digits of division followed by one digit per
+    level, trailing zeros mean higher levels. Codes sorted by their significant
+    digits keep every subtree contiguous, so descendants of a code are found
+    with two binary searches.
+    """
+
+    @staticmethod
+    def prefix(code):
+        digits = code.split('-', 1)[0]
+        return digits[:2] + digits[2:].rstrip('0')
+
+    def reset(self):
+        super(ClassificationCodes, self).reset()
+        self.__dict__.pop('_prefixes', None)
+
+    def _build_tree(self):
+        prefixes = dict([(self.prefix(i), i) for i in self])
+        self._prefixes = prefixes
+        self._sorted = sorted(prefixes)
+        return prefixes
+
+    @property
+    def tree(self):
+        prefixes = self.__dict__.get('_prefixes')
+        return prefixes if prefixes is not None else self._build_tree()
+
+    def descendants(self, code):
+        """ All codes under ``code`` (a code or a digits prefix) """
+        tree = self.tree
+        prefix = self.prefix(code)
+        start = bisect_left(self._sorted, prefix)
+        end = bisect_left(self._sorted, prefix + ':')  # ':' follows digits
+        return [tree[i] for i in self._sorted[start:end] if i != prefix]
+
+    def parent(self, code):
+        """ The closest code above ``code`` or None """
+        tree = self.tree
+        prefix = self.prefix(code)
+        for i in range(len(prefix) - 1, 1, -1):
+            if prefix[:i] in tree:
+                return tree[prefix[:i]]
+
+    def children(self, code):
+        return [i for i in self.descendants(code) if self.parent(i) == code]
+
+
 DEBTOR_TYPES = ['naturalPerson', 'legalPerson']
 
 DEFAULT_CURRENCY = u'UAH'
@@ -36,8 +176,8 @@ DEFAULT_ITEM_CLASSIFICATION = u'CAV'
 
 DOCUMENT_TYPES = ['notice', 'technicalSpecifications', 'illustration', 'virtualDataRoom', 'x_presentation']
 
-CPV_CODES = read_json('cpv.json')
-CAV_CODES = read_json('cav.json')
+CPV_CODES = ClassificationCodes(partial(read_codes, 'cpv.json'))
+CAV_CODES = ClassificationCodes(partial(read_codes, 'cav.json'))
 
 ITEM_CLASSIFICATIONS = {
     u'CAV': CAV_CODES,
@@ -45,7 +185,7 @@ ITEM_CLASSIFICATIONS = {
     #u'CAV-PS': []
 }
 
-ORA_CODES = [i['code'] for i in read_json('OrganisationRegistrationAgency.json')['data']]
+ORA_CODES = CodeList(partial(read_codes, 'OrganisationRegistrationAgency.json', 'code'))
 
 IDENTIFIER_CODES = ORA_CODES
 
@@ -56,5 +196,11 @@ COORDINATES_REG_EXP = re.compile(r'-?\d{1,3}\.\d+|-?\d{1,3}')
 VERSION = '{}.{}'.format(int(PKG.parsed_version[0]), int(PKG.parsed_version[1]) if PKG.parsed_version[1].isdigit() else 0)
 ROUTE_PREFIX = '/api/{}'.format(VERSION)
 
+STREAM_CHUNK_SIZE = 1000
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream',
+}
+
 SCHEMA_VERSION = 1
 SCHEMA_DOC = 'openregistry_schema'
@@ -4,10 +4,12 @@ import os
 from logging import getLogger
 from pbkdf2 import PBKDF2
 from ConfigParser import ConfigParser
-from couchdb import Server as CouchdbServer, Session
+from couchdb import Server as CouchdbServer
 from couchdb.http import Unauthorized, extract_credentials
+from pyramid.settings import asbool
 
 from openregistry.api.design import sync_design
+from openregistry.api.transport import couchdb_session
 
 LOGGER = getLogger("{}.init".format(__name__))
 
@@ -55,18 +57,20 @@ class Server(CouchdbServer):
 def set_api_security(settings):
     # CouchDB connection
     db_name = os.environ.get('DB_NAME', settings['couchdb.db_name'])
+    staged = asbool(settings.get('design.staged', False))
     server = Server(settings.get('couchdb.url'),
-                    session=Session(retry_delays=range(10)))
+                    session=couchdb_session(settings))
     if 'couchdb.admin_url' not in settings and server.resource.credentials:
         try:
             server.version()
         except Unauthorized:
             server = Server(extract_credentials(
-                settings.get('couchdb.url'))[0])
+                settings.get('couchdb.url'))[0],
+                session=couchdb_session(settings))
 
     if 'couchdb.admin_url' in settings and server.resource.credentials:
         aserver = Server(settings.get('couchdb.admin_url'),
-                         session=Session(retry_delays=range(10)))
+                         session=couchdb_session(settings))
         users_db = aserver['_users']
         if SECURITY != users_db.security:
             LOGGER.info("Updating users db security",
@@ -129,14 +133,14 @@ def set_api_security(settings):
                         extra={'MESSAGE_ID': 'update_api_validate_doc'})
             db.save(auth_doc)
         # sync couchdb views
-        sync_design(db)
+        sync_design(db, staged)
         db = server[db_name]
     else:
         if db_name not in server:
             server.create(db_name)
         db = server[db_name]
         # sync couchdb views
-        sync_design(db)
+        sync_design(db, staged)
         aserver = None
     return aserver, server, db
 
@@ -1,14 +1,265 @@
 # -*- coding: utf-8 -*-
+from json import dumps
+from hashlib import sha1
+from logging import getLogger
+from gevent import spawn, sleep
 from couchdb.design import ViewDefinition
+from couchdb.http import ResourceConflict, ResourceNotFound
+
+LOGGER = getLogger(__name__)
+
+DESIGN_HASH_FIELD = 'hash'
+STAGING_SUFFIX = '_staging'
+
+# 'design/view' names of views added by a staged deploy still in progress
+PENDING_VIEWS = set()
 
 
 def add_index_options(doc):
     doc['options'] = {'local_seq': True}
 
 
-def sync_design(db):
-    views = [j for i, j in globals().items() if "_view" in i]
-    ViewDefinition.sync_many(db, views, callback=add_index_options)
+# Projection views serve listings with custom ``opt_fields`` straight from
+# the index: PROJECTIONS[resource][feed][mode] is a list of (fields, view).
+PROJECTIONS = {}
+
+PROJECTION_KEYS = {
+    u'dateModified': 'doc.dateModified',
+    u'changes': 'doc._local_seq',
+}
+
+PROJECTION_MODES = {
+    u'': "doc.mode !== 'test'",
+    u'test': "doc.mode === 'test'",
+    u'_all_': 'true',
+}
+
+PROJECTION_VIEW_TEMPLATE = '''function(doc) {
+    if((%(condition)s) && (%(mode)s)) {
+        var fields=%(fields)s, data={};
+        for (var i in fields) {
+            if (doc[fields[i]]) {
+                data[fields[i]] = doc[fields[i]]
+            }
+        }
+        emit(%(key)s, data);
+    }
+}'''
+
+
+def add_projection(resource, fields, condition, modes=None):
+    """
+    Registers listing projection views of ``resource`` for each feed and
+    mode. Views emit only ``fields`` (changes feed views also emit
+    dateModified) and are synced along with other views by ``sync_design``.
+    """
+    fields = sorted(set(fields))
+    for feed, key in PROJECTION_KEYS.items():
+        view_fields = sorted(set(fields + ['dateModified'])) if feed == u'changes' else fields
+        for mode in modes or PROJECTION_MODES:
+            name = '{}_projection_{}_by_{}'.format(mode.strip('_') or 'real', '_'.join(fields), feed)
+            view = ViewDefinition(resource, name, PROJECTION_VIEW_TEMPLATE % {
+                'condition': condition,
+                'mode': PROJECTION_MODES[mode],
+                'fields': dumps(view_fields),
+                'key': key,
+            })
+            globals()['{}_{}_view'.format(resource, name)] = view
+            PROJECTIONS.setdefault(resource, {}).setdefault(feed, {}).setdefault(mode, []).append(
+                (frozenset(view_fields), view)
+            )
+
+
+def get_views():
+    return [j for i, j in globals().items() if "_view" in i]
+
+
+def design_hash(doc):
+    return sha1(dumps(
+        dict([(i, j) for i, j in doc.items() if i not in ('_id', '_rev', DESIGN_HASH_FIELD)]),
+        sort_keys=True
+    )).hexdigest()
+
+
+def build_design_docs(views):
+    """ Builds design documents from view definitions stamped with their content hash """
+    docs = {}
+    for view in views:
+        doc = docs.setdefault(view.design, {
+            '_id': '_design/{}'.format(view.design),
+            'language': view.language,
+            'views': {}
+        })
+        if doc['language'] != view.language:
+            raise ValueError('Found different language views in one design document ({})'.format(view.design))
+        funcs = {'map': view.map_fun}
+        if view.reduce_fun:
+            funcs['reduce'] = view.reduce_fun
+        if view.options:
+            funcs['options'] = view.options
+        doc['views'][view.name] = funcs
+    for doc in docs.values():
+        add_index_options(doc)
+        doc[DESIGN_HASH_FIELD] = design_hash(doc)
+    return docs
+
+
+def get_stored_design_docs(db):
+    return dict([
+        (row.id, row.doc)
+        for row in db.view('_all_docs', startkey='_design/', endkey='_design0', include_docs=True)
+    ])
+
+
+def diff_design_docs(db, docs, stored=None):
+    """
+    Returns design documents whose hash differs from the stored ones.
+    Views of stored design documents that are not defined here are kept.
+    """
+    if stored is None:
+        stored = get_stored_design_docs(db)
+    changed = []
+    for name in sorted(docs):
+        doc = docs[name]
+        current = stored.get(doc['_id'])
+        if current is None:
+            changed.append(doc)
+        elif current.get(DESIGN_HASH_FIELD) != doc[DESIGN_HASH_FIELD]:
+            views = dict(current.get('views', {}))
+            views.update(doc['views'])
+            changed.append(dict(doc, _rev=current['_rev'], views=views))
+    return changed
+
+
+def is_pending(view):
+    return '{}/{}'.format(view.design, view.name) in PENDING_VIEWS
+
+
+def view_names(doc_id, views):
+    name = doc_id[len('_design/'):]
+    return set(['{}/{}'.format(name, i) for i in views])
+
+
+def get_index_seq(db, design_name):
+    _, _, info = db.resource('_design', design_name, '_info').get_json()
+    return info['view_index']['update_seq']
+
+
+def is_deployed(db, doc):
+    current = db.get(doc['_id'])
+    return current is not None and current.get(DESIGN_HASH_FIELD) == doc[DESIGN_HASH_FIELD]
+
+
+def stage_design_doc(db, doc, staging_id):
+    """
+    Saves the staging copy of ``doc``, returns False if a copy of another
+    version is staged already. A copy of the same version is shared.
+    """
+    staging_doc = dict(doc, _id=staging_id)
+    staging_doc.pop('_rev', None)
+    try:
+        db.save(staging_doc)
+    except ResourceConflict:
+        current = db.get(staging_id)
+        return current is None or current.get(DESIGN_HASH_FIELD) == doc[DESIGN_HASH_FIELD]
+    return True
+
+
+def finish_deploy(db, doc, staging_id):
+    """ Saves ``doc`` under its real name unless it is there already and removes the staging copy """
+    if not is_deployed(db, doc):
+        current = db.get(doc['_id'])
+        doc = dict(doc)
+        doc.pop('_rev', None)
+        if current is not None:
+            doc['_rev'] = current['_rev']
+        try:
+            db.save(doc)
+        except ResourceConflict:
+            if not is_deployed(db, doc):
+                return False
+    staging_doc = db.get(staging_id)
+    if staging_doc is not None and staging_doc.get(DESIGN_HASH_FIELD) == doc[DESIGN_HASH_FIELD]:
+        try:
+            db.delete(staging_doc)
+        except (ResourceConflict, ResourceNotFound):
+            # removed or replaced by another process
+            pass
+    return True
+
+
+def deploy_design_docs(db, docs, poll_interval=5):
+    """
+    Deploys design documents without making listings wait for index builds.
+
+    Every document is saved under a staging name first and its index is
+    built by querying it with ``stale=update_after``. Once the index has
+    caught up with the database, the document is saved under its real name:
+    its views are the same, so CouchDB reuses the already built index.
+
+    Processes deploying the same version share the staging document and
+    the first one to finish saves the real one. A staging document of
+    another version is left alone and the document is not deployed, so
+    staging documents of interrupted deploys have to be removed by hand.
+    """
+    staged = []
+    for doc in docs:
+        name = doc['_id'][len('_design/'):]
+        staging_name = '{}{}'.format(name, STAGING_SUFFIX)
+        staging_id = '_design/{}'.format(staging_name)
+        if not stage_design_doc(db, doc, staging_id):
+            LOGGER.warning('Design document {} of another version is being deployed'.format(name),
+                           extra={'MESSAGE_ID': 'sync_design_conflict'})
+            continue
+        try:
+            db.view('{}/{}'.format(staging_name, sorted(doc['views'])[0]), stale='update_after', limit=1).rows
+        except ResourceNotFound:
+            # deployed and removed by another process
+            pass
+        staged.append((doc, staging_id, staging_name))
+    target_seq = db.info()['update_seq']
+    for doc, staging_id, staging_name in staged:
+        while not is_deployed(db, doc):
+            try:
+                index_seq = get_index_seq(db, staging_name)
+            except ResourceNotFound:
+                # deployed and removed by another process
+                break
+            LOGGER.info('Building index of {}: {}/{}'.format(doc['_id'], index_seq, target_seq),
+                        extra={'MESSAGE_ID': 'sync_design_progress'})
+            if index_seq >= target_seq:
+                break
+            sleep(poll_interval)
+        if finish_deploy(db, doc, staging_id):
+            PENDING_VIEWS.difference_update(view_names(doc['_id'], doc['views']))
+            LOGGER.info('Deployed {}'.format(doc['_id']), extra={'MESSAGE_ID': 'sync_design_deployed'})
+        else:
+            LOGGER.warning('Design document {} was changed by another process'.format(doc['_id']),
+                           extra={'MESSAGE_ID': 'sync_design_conflict'})
+
+
+def sync_design(db, staged=False):
+    """
+    Writes design documents that differ from the stored ones.
+    With ``staged`` changed documents are deployed in the background by
+    ``deploy_design_docs``, views they add are kept in ``PENDING_VIEWS``
+    until then and listings do not use them. Returns ids of changed design
+    documents.
+    """
+    stored = get_stored_design_docs(db)
+    docs = diff_design_docs(db, build_design_docs(get_views()), stored)
+    if not docs:
+        return []
+    if staged:
+        for doc in docs:
+            current_views = stored.get(doc['_id'], {}).get('views', {})
+            PENDING_VIEWS.update(view_names(doc['_id'], set(doc['views']) - set(current_views)))
+        spawn(deploy_design_docs, db, docs)
+    else:
+        db.update(docs)
+    LOGGER.info('Syncing design documents: {}'.format(', '.join([i['_id'] for i in docs])),
+                extra={'MESSAGE_ID': 'sync_design'})
+    return [i['_id'] for i in docs]
 
 
 conflicts_view = ViewDefinition('conflicts', 'all', '''function(doc) {
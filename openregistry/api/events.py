@@ -10,3 +10,15 @@ class ErrorDesctiptorEvent(object):
         self.errors = request.errors
         self.params = params
         self.request = request
+
+
+class DatabaseChangesEvent(object):
+    """ Database changes event.
+        Notified by the changes feed follower for every batch of changes,
+        'results' are rows of CouchDB '_changes' response.
+    """
+
+    def __init__(self, registry, results, last_seq):
+        self.registry = registry
+        self.results = results
+        self.last_seq = last_seq
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import hmac
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from binascii import Error as BinasciiError
+from hashlib import sha256
+from itertools import dropwhile
+from json import dumps, loads
+
+CURSOR_SIGNATURE_SIZE = 9
+# the largest code point, used to build the byte-wise predecessor of a docid
+MAX_CHAR = u'\U0010ffff'
+
+
+def _b64encode(data):
+    return urlsafe_b64encode(data).rstrip('=')
+
+
+def _b64decode(data):
+    return urlsafe_b64decode(str(data) + '=' * (-len(data) % 4))
+
+
+def cursor_secret(server, db):
+    """ Cursors are bound to the database they were issued for,
+        the same way encrypted offsets were bound to server uuid and db name.
+    """
+    return '{}/{}'.format(server.uuid, db.name)
+
+
+def next_docid(docid, descending=False):
+    """
+    Returns ``startkey_docid`` for resuming a listing right after ``docid``.
+
+    CouchDB orders rows with equal keys by the raw bytes of their docids, so
+    appending the lowest character gives the first docid after ``docid`` and
+    replacing the last character with its predecessor padded with the highest
+    character gives the closest docid before it.
+    """
+    if not descending:
+        return docid + u'\x00'
+    if not docid or docid[-1] == u'\x00':
+        return docid[:-1]
+    return docid[:-1] + unichr(ord(docid[-1]) - 1) + MAX_CHAR
+
+
+class Cursor(object):
+    """
+    Keyset position inside a listing view.
+
+    Points at the last row returned to the client: the view key (dateModified
+    or local seq for the changes feed) and the docid of that row, together
+    with the view (mode, feed) and direction it was issued for. The encoded
+    form is an url-safe base64 payload followed by a truncated HMAC.
+    """
+    __slots__ = ('key', 'docid', 'mode', 'feed', 'descending')
+
+    def __init__(self, key, docid=None, mode=u'', feed=u'', descending=False):
+        self.key = key
+        self.docid = docid
+        self.mode = mode
+        self.feed = feed
+        self.descending = bool(descending)
+
+    def __repr__(self):
+        return '<Cursor {!r}:{!r} mode={!r} feed={!r} descending={}>'.format(
+            self.key, self.docid, self.mode, self.feed, self.descending)
+
+    def __eq__(self, other):
+        if isinstance(other, Cursor):
+            return all(getattr(self, i) == getattr(other, i) for i in self.__slots__)
+        return NotImplemented
+
+    def __ne__(self, other):
+        return not self == other
+
+    @staticmethod
+    def sign(secret, payload):
+        digest = hmac.new(secret, payload, sha256).digest()
+        return _b64encode(digest[:CURSOR_SIGNATURE_SIZE])
+
+    def encode(self, secret):
+        payload = _b64encode(dumps(
+            [self.key, self.docid, self.mode, self.feed, int(self.descending)],
+            separators=(',', ':')
+        ))
+        return '{}.{}'.format(payload, self.sign(secret, payload))
+
+    @classmethod
+    def decode(cls, value, secret):
+        """ Returns decoded cursor or None if value is not a valid cursor """
+        try:
+            payload, signature = str(value).split('.', 1)
+        except (ValueError, UnicodeEncodeError):
+            return None
+        if not hmac.compare_digest(cls.sign(secret, payload), signature):
+            return None
+        try:
+            key, docid, mode, feed, descending = loads(_b64decode(payload))
+        except (TypeError, ValueError, BinasciiError):
+            return None
+        return cls(key, docid, mode, feed, descending)
+
+    def matches(self, mode, feed, descending):
+        return self.mode == mode and self.feed == feed and self.descending == descending
+
+    def reverse(self):
+        return Cursor(self.key, self.docid, self.mode, self.feed, not self.descending)
+
+    def view_params(self):
+        """ CouchDB view parameters that resume the listing after the cursor """
+        params = {'startkey': self.key}
+        if self.docid is not None:
+            params['startkey_docid'] = next_docid(self.docid, self.descending)
+        return params
+
+
+def iter_view_chunks(view, chunk_size, descending=False, params=None):
+    """
+    Yields rows of the view in lists of at most ``chunk_size`` rows,
+    resuming every next query right after the last row of the previous one.
+    """
+    params = params or {}
+    while True:
+        rows = list(view(limit=chunk_size, **params))
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        params = Cursor(rows[-1].key, rows[-1].id, descending=descending).view_params()
+
+
+def skip_key(view, key, descending=False):
+    """
+    Wraps ``view`` to drop the rows with ``key`` at the start of the listing.
+
+    Plain dateModified offsets of earlier API versions are the key of the last
+    row returned, the listing continues after it. The view is read further if
+    dropped rows leave the first query short, queries resumed with keyset
+    parameters are passed through.
+    """
+    def skipping_view(limit, **params):
+        if params:
+            return view(limit=limit, **params)
+        rows = []
+        while True:
+            count = limit - len(rows)
+            chunk = list(view(limit=count, **params))
+            rows.extend(chunk if rows else dropwhile(lambda row: row.key == key, chunk))
+            if len(rows) == limit or len(chunk) < count:
+                return rows
+            params = Cursor(chunk[-1].key, chunk[-1].id, descending=descending).view_params()
+    return skipping_view
+
+
+def plan_view(fields, view, view_fields, projections):
+    """
+    Picks the narrowest view that covers requested ``fields``: either the
+    listing ``view`` emitting ``view_fields`` or one of ``projections``,
+    a list of (fields, view) pairs. Returns None if no view covers them.
+    """
+    fields = set(fields)
+    view_fields = set(view_fields)
+    candidates = [(len(view_fields), view)] if fields.issubset(view_fields) else []
+    candidates.extend([(len(i), j) for i, j in projections if fields.issubset(i)])
+    if candidates:
+        return min(candidates, key=lambda i: i[0])[1]
@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
-from schematics.types import StringType, BaseType
+from schematics.exceptions import ConversionError, ModelConversionError
+from schematics.models import FieldDescriptor
+from schematics.types import StringType, BaseType, IntType
 from schematics.types.compound import DictType, ListType, ModelType
-from openregistry.api.utils import get_now
+from openregistry.api.utils import get_now, set_parent
 from schematics.types.serializable import serializable
-from couchdb_schematics.document import SchematicsDocument
+from couchdb_schematics.document import SchematicsDocument, DocumentMeta
 
-from .schematics_extender import Model, IsoDateTimeType
+from .schematics_extender import Model, ModelMeta, IsoDateTimeType
 
 
 class Revision(Model):
@@ -15,7 +17,42 @@ class Revision(Model):
     rev = StringType()
 
 
+class LazyFieldDescriptor(FieldDescriptor):
+    """ Field descriptor converting raw values of lazily wrapped documents on access """
+
+    def __get__(self, instance, cls):
+        if instance is None:
+            return cls._fields[self.name]
+        raw = instance.__dict__.get('_raw')
+        if raw and self.name in raw:
+            instance.hydrate(self.name)
+        try:
+            return instance.__dict__['_data'][self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, instance, value):
+        raw = instance.__dict__.get('_raw')
+        if raw:
+            raw.pop(self.name, None)
+        field = instance._fields[self.name]
+        if value is not None and not isinstance(value, Model) and isinstance(field, ModelType):
+            value = field.model_class(value)
+        instance.__dict__['_data'][self.name] = value
+
+
+class ResourceItemMeta(ModelMeta, DocumentMeta):
+
+    def __new__(mcs, name, bases, attrs):
+        klass = super(ResourceItemMeta, mcs).__new__(mcs, name, bases, attrs)
+        for field_name in klass._fields:
+            setattr(klass, field_name, LazyFieldDescriptor(field_name))
+        return klass
+
+
 class BaseResourceItem(SchematicsDocument, Model):
+    __metaclass__ = ResourceItemMeta
+
     owner = StringType()
     owner_token = StringType()
     mode = StringType(choices=['test'])
@@ -23,6 +60,7 @@ class BaseResourceItem(SchematicsDocument, Model):
 
     _attachments = DictType(DictType(BaseType), default=dict())  # couchdb attachments
     revisions = ListType(ModelType(Revision), default=list())
+    revisionSegments = ListType(IntType())  # sizes of revision segments moved out of the document
 
     __name__ = ''
 
@@ -34,6 +72,50 @@ class BaseResourceItem(SchematicsDocument, Model):
         """A property that is serialized by schematics exports."""
         return self._id
 
+    @classmethod
+    def wrap_lazy(cls, data):
+        """
+        Instantiates the resource from a raw document leaving nested fields
+        (revisions, attachments, documents...) unconverted until they are
+        accessed as attributes. Any use of the whole model data (validation,
+        export, patching) converts them all first, so such resources behave as
+        ones created with ``wrap``, apart from conversion errors of nested
+        fields raised on access.
+        """
+        raw = dict([(i, data[i]) for i in cls._meta.lazy_fields if data.get(i) is not None])
+        instance = cls.__new__(cls)
+        instance._initial = data
+        instance._data = instance.convert(dict([(i, j) for i, j in data.items() if i not in raw]), strict=True)
+        instance.doc_type = cls.__name__
+        instance.__dict__['_raw'] = raw
+        return instance
+
+    def hydrate(self, name=None):
+        """ Converts raw values of nested fields, all of them if ``name`` is None """
+        raw = self.__dict__.get('_raw')
+        names = raw.keys() if name is None else [name]
+        for name in names:
+            field = self._fields[name]
+            try:
+                value = field.to_native(raw[name])
+            except ConversionError as e:
+                raise ModelConversionError({name: e.messages})
+            for i in value if isinstance(value, list) else [value]:
+                set_parent(i, self)
+            self.__dict__['_data'][name] = value
+            del raw[name]
+
+    def _get_data(self):
+        if self.__dict__.get('_raw'):
+            self.hydrate()
+        return self.__dict__['_data']
+
+    def _set_data(self, data):
+        self.__dict__['_raw'] = None
+        self.__dict__['_data'] = data
+
+    _data = property(_get_data, _set_data)
+
     def import_data(self, raw_data, **kw):
         """
         Converts and imports the raw data into the instance of the model
@@ -42,7 +124,7 @@ class BaseResourceItem(SchematicsDocument, Model):
             The data to be imported.
         """
         data = self.convert(raw_data, **kw)
-        del_keys = [k for k in data.keys() if data[k] == self.__class__.fields[k].default or data[k] == getattr(self, k)]
+        del_keys = [k for k in data.keys() if data[k] == self._meta.default(k) or data[k] == getattr(self, k)]
         for k in del_keys:
             del data[k]
         self._data.update(data)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+ISO 8601 dates codec.
+
+Dates written by the API itself (``datetime.isoformat()`` of aware dates,
+``YYYY-MM-DDTHH:MM:SS[.ffffff]+HH:MM``) are parsed with a single strict regular
+expression and shared offset instances, anything else goes through
+``iso8601.parse_date``. Parsed strings are memoized, as revision and
+document dates repeat a lot within a resource.
+"""
+import re
+from datetime import datetime
+from iso8601 import parse_date as iso8601_parse_date, ParseError, FixedOffset, UTC
+
+from openregistry.api.constants import TZ
+
+API_DATE_REGEX = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{6}))?(?:([+-])(\d\d):(\d\d)|Z)$'
+)
+
+MEMO_SIZE = 10000
+
+OFFSETS = {}
+MEMO = {}
+
+
+def get_offset(sign, hours, minutes):
+    """ Shared tzinfo for the offset, same as one ``iso8601`` builds """
+    key = (sign, hours, minutes)
+    tz = OFFSETS.get(key)
+    if tz is None:
+        description = '%s%s:%s' % key
+        hours, minutes = int(hours), int(minutes)
+        if sign == '-':
+            hours, minutes = -hours, -minutes
+        tz = OFFSETS[key] = FixedOffset(hours, minutes, description)
+    return tz
+
+
+def parse_api_date(value):
+    """ Parses dates in the API format or returns None """
+    match = API_DATE_REGEX.match(value)
+    if match is None:
+        return None
+    year, month, day, hour, minute, second, fraction, sign, tz_hours, tz_minutes = match.groups()
+    tz = get_offset(sign, tz_hours, tz_minutes) if sign else UTC
+    try:
+        return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                        int(fraction) if fraction else 0, tz)
+    except ValueError as e:
+        raise ParseError(e)
+
+
+def parse_date(value):
+    """
+    Parses ISO 8601 date, dates without a time zone are in ``TZ``.
+    Raises ``ParseError`` like ``iso8601.parse_date``.
+    """
+    if not isinstance(value, basestring):
+        raise ParseError('Expecting a string %r' % value)
+    date = MEMO.get(value)
+    if date is not None:
+        return date
+    date = parse_api_date(value)
+    if date is None:
+        date = iso8601_parse_date(value, None)
+        if not date.tzinfo:
+            date = TZ.localize(date)
+    if len(MEMO) >= MEMO_SIZE:
+        MEMO.clear()
+    MEMO[value] = date
+    return date
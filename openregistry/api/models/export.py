@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled serialization of models to primitives.
+
+For every (model class, role) pair the fields left by the role are resolved
+once into a list of export steps with a converter picked per field type, so
+exporting an instance walks its data directly instead of going through
+schematics ``export_loop`` with per-field dispatch. Roles whose filters
+depend on values, ordered fields, ``print_none`` and ``context`` exports are
+left to schematics.
+"""
+from schematics.models import Model
+from schematics.transforms import Role, export_loop, allow_none
+from schematics.types import BaseType
+from schematics.types.compound import ModelType, ListType
+from schematics.types.serializable import Serializable
+
+# role filters that do not depend on field values
+STATIC_ROLE_FUNCTIONS = (Role.wholelist, Role.whitelist, Role.blacklist)
+
+# to_primitive implementations -> faster equivalent, None for identity
+PRIMITIVE_CONVERTERS = {
+    BaseType.to_primitive.im_func: None,
+}
+
+EXPORTERS = {}
+
+
+def register_primitive(type_class, converter=None):
+    """ Declares ``converter`` equivalent to ``to_primitive`` of ``type_class`` """
+    PRIMITIVE_CONVERTERS[type_class.to_primitive.im_func] = converter
+
+
+def primitive_converter(field, value):
+    return field.to_primitive(value)
+
+
+def hidden_fields(cls, role):
+    """ Names of fields hidden by ``role`` or None if it depends on values """
+    roles = cls._options.roles
+    role = roles[role] if role in roles else roles.get('default')
+    if role is None:
+        return frozenset()
+    if not isinstance(role, Role) or role.function not in STATIC_ROLE_FUNCTIONS:
+        return None
+    return frozenset([i for i in list(cls._fields) + list(cls._serializables) if role(i, None)])
+
+
+def export_nested(cls, value, role):
+    if not isinstance(value, Model):
+        return export_loop(cls, value, primitive_converter, role=role)
+    exporter = get_exporter(type(value), role)
+    if exporter is None:
+        return export_loop(type(value), value, primitive_converter, role=role)
+    return exporter(value)
+
+
+def compile_model_type(field, role):
+    model_class = field.model_class
+
+    def convert(value):
+        cls = model_class if not isinstance(value, model_class) else type(value)
+        return export_nested(cls, value, role) or None
+    return convert
+
+
+def compile_list_type(field, role):
+    item_field = field.field
+    convert_item = compile_field(item_field, role)
+    item_compound = hasattr(item_field, 'export_loop')
+    item_allow_none = item_field.allow_none()
+    list_allow_none = field.allow_none()
+
+    def convert(value):
+        data = []
+        for item in value:
+            shaped = convert_item(item) if convert_item else item
+            if shaped is not None or (not item_compound and item_allow_none):
+                data.append(shaped)
+        if data or list_allow_none:
+            return data
+    return convert
+
+
+# export_loop implementations -> compilers of equivalent converters
+COMPOUND_COMPILERS = {
+    ModelType.export_loop.im_func: compile_model_type,
+    ListType.export_loop.im_func: compile_list_type,
+}
+
+
+def register_compound(type_class, compiler):
+    """ Declares ``compiler`` builds converters equivalent to ``export_loop`` of ``type_class`` """
+    COMPOUND_COMPILERS[type_class.export_loop.im_func] = compiler
+
+
+def compile_field(field, role):
+    """ Returns converter of non-None values of the field, None for identity """
+    field_type = field.type if isinstance(field, Serializable) else field
+    if hasattr(field_type, 'export_loop'):
+        compiler = COMPOUND_COMPILERS.get(type(field_type).export_loop.im_func)
+        if compiler is not None:
+            return compiler(field_type, role)
+        return lambda value: field_type.export_loop(value, primitive_converter, role=role)
+    to_primitive = type(field_type).to_primitive.im_func
+    if to_primitive in PRIMITIVE_CONVERTERS:
+        return PRIMITIVE_CONVERTERS[to_primitive]
+    return field_type.to_primitive
+
+
+def compile_model(cls, role):
+    """ Builds exporter of ``cls`` instances for ``role`` or returns None """
+    hidden = hidden_fields(cls, role)
+    if hidden is None or getattr(cls._options, 'fields_order', None):
+        return None
+    steps = []
+    for fields, serializable in ((cls._fields, False), (cls._serializables, True)):
+        for name, field in fields.items():
+            if name in hidden:
+                continue
+            steps.append((
+                name, field.serialized_name or name, serializable,
+                compile_field(field, role), allow_none(cls, field)
+            ))
+
+    def export(instance):
+        data = {}
+        values = instance._data
+        for name, key, serializable, convert, none in steps:
+            value = getattr(instance, name) if serializable else values.get(name)
+            if value is not None:
+                shaped = convert(value) if convert else value
+                if shaped is not None or none:
+                    data[key] = shaped
+            elif none:
+                data[key] = None
+        return data or None
+    return export
+
+
+def get_exporter(cls, role):
+    if (cls, role) not in EXPORTERS:
+        EXPORTERS[cls, role] = compile_model(cls, role)
+    return EXPORTERS[cls, role]
+
+
+def to_primitive(instance, role=None):
+    """ Same as schematics ``to_primitive`` of the model instance """
+    cls = type(instance)
+    if role and role not in cls._options.roles:
+        raise ValueError(u'%s Model has no role "%s"' % (cls.__name__, role))
+    exporter = get_exporter(cls, role)
+    if exporter is None:
+        return export_loop(cls, instance, primitive_converter, role=role, raise_error_on_role=True)
+    return exporter(instance)
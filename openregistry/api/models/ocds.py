@@ -19,6 +19,7 @@ from openregistry.api.constants import (DEFAULT_CURRENCY,
 )
 from openregistry.api.utils import get_now, serialize_document_url
 
+from .export import register_primitive
 from .schematics_extender import Model, IsoDateTimeType, HashType
 from .roles import document_roles, organization_roles
 
@@ -176,6 +177,9 @@ class DecimalType(BaseDecimalType):
         return value
 
 
+register_primitive(DecimalType)
+
+
 class Item(Model):
     """A good, service, or work to be contracted."""
     id = StringType(required=True, min_length=1, default=lambda: uuid4().hex)
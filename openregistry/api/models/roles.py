@@ -5,7 +5,7 @@ from couchdb_schematics.document import SchematicsDocument
 schematics_default_role = SchematicsDocument.Options.roles['default'] + blacklist("__parent__")
 schematics_embedded_role = SchematicsDocument.Options.roles['embedded'] + blacklist("__parent__")
 
-plain_role = (blacklist('_attachments', 'revisions', 'dateModified') + schematics_embedded_role)
+plain_role = (blacklist('_attachments', 'revisions', 'revisionSegments', 'dateModified') + schematics_embedded_role)
 listing_role = whitelist('dateModified', 'doc_id')
 draft_role = whitelist('status')
 
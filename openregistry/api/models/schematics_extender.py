@@ -1,15 +1,19 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
-from iso8601 import parse_date, ParseError
+from operator import methodcaller
+from iso8601 import ParseError
 from hashlib import algorithms, new as hash_new
 from schematics.exceptions import ConversionError, ValidationError
 
-from schematics.models import Model as SchematicsModel
+from schematics.models import Model as SchematicsModel, ModelMeta as SchematicsModelMeta
 
 from schematics.types.compound import ListType as BaseListType
 from schematics.types import BaseType, StringType
-from schematics.transforms import blacklist, export_loop, convert
-from openregistry.api.constants import TZ
+from schematics.transforms import Role, blacklist, export_loop, convert
+from openregistry.api.models.dates import parse_date
+from openregistry.api.models.export import (
+    STATIC_ROLE_FUNCTIONS, compile_list_type, register_compound, register_primitive, to_primitive
+)
 from openregistry.api.utils import set_parent
 
 
@@ -22,10 +26,7 @@ class IsoDateTimeType(BaseType):
         if isinstance(value, datetime):
             return value
         try:
-            date = parse_date(value, None)
-            if not date.tzinfo:
-                date = TZ.localize(date)
-            return date
+            return parse_date(value)
         except ParseError:
             raise ConversionError(self.messages['parse'].format(value))
         except OverflowError as e:
@@ -35,6 +36,9 @@ class IsoDateTimeType(BaseType):
         return value.isoformat()
 
 
+register_primitive(IsoDateTimeType, methodcaller('isoformat'))
+
+
 class HashType(StringType):
 
     MESSAGES = {
@@ -99,7 +103,65 @@ class ListType(BaseListType):
             return data
 
 
+# differs from the base list export only when printing None values
+register_compound(ListType, compile_list_type)
+
+
+class ModelDescriptor(object):
+    """
+    Structure of a model class resolved once when the class is created:
+    field order, static defaults and names of fields hidden by each role.
+    """
+
+    def __init__(self, cls):
+        self.model_class = cls
+        self.fields = tuple(cls._fields)
+        self.data_fields = tuple([i for i in self.fields if i != '__parent__'])
+        self.serializables = tuple(cls._serializables)
+        self.defaults = {}
+        self.dynamic_defaults = set()
+        for name, field in cls._fields.items():
+            if callable(field._default):
+                self.dynamic_defaults.add(name)
+            else:
+                self.defaults[name] = field._default
+        # nested fields read under their own names, may be converted on access
+        self.lazy_fields = frozenset([
+            name for name, field in cls._fields.items()
+            if hasattr(field, 'export_loop') and not field.serialized_name and not field.deserialize_from
+        ])
+        self.roles = cls._options.roles
+        self.hidden = {}
+        for name, role in self.roles.items():
+            if isinstance(role, Role) and role.function in STATIC_ROLE_FUNCTIONS:
+                self.hidden[name] = frozenset([
+                    i for i in self.fields + self.serializables if role(i, None)
+                ])
+
+    def default(self, name):
+        if name in self.dynamic_defaults:
+            return self.model_class._fields[name].default
+        return self.defaults.get(name)
+
+    def is_hidden(self, role, name, value=None):
+        """ Same as applying ``role`` filter (or 'default' for unknown roles) """
+        role = role if role in self.roles else 'default'
+        if role in self.hidden:
+            return name in self.hidden[role]
+        return role in self.roles and bool(self.roles[role](name, value))
+
+
+class ModelMeta(SchematicsModelMeta):
+
+    def __new__(mcs, name, bases, attrs):
+        klass = super(ModelMeta, mcs).__new__(mcs, name, bases, attrs)
+        klass._meta = ModelDescriptor(klass)
+        return klass
+
+
 class Model(SchematicsModel):
+    __metaclass__ = ModelMeta
+
     class Options(object):
         """Export options for Document."""
         serialize_when_none = False
@@ -112,8 +174,8 @@ class Model(SchematicsModel):
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            for k in self._fields:
-                if k != '__parent__' and self.get(k) != other.get(k):
+            for k in self._meta.data_fields:
+                if self.get(k) != other.get(k):
                     return False
             return True
         return NotImplemented
@@ -132,6 +194,12 @@ class Model(SchematicsModel):
                 set_parent(j, self)
         return value
 
+    def to_primitive(self, role=None, context=None):
+        """ Exports the model using compiled exporters unless context is given """
+        if context is not None:
+            return super(Model, self).to_primitive(role, context)
+        return to_primitive(self, role)
+
     def to_patch(self, role=None):
         """
         Return data as it would be validated. No filtering of output unless
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+JSON renderers writing large responses in chunks.
+
+Outer dicts and lists of a value are written element by element and their
+elements are encoded one at a time, so listings and big resources start
+streaming right away and the whole body is never held in memory. Responses
+that fit into one chunk are returned as a single string and keep their
+Content-Length.
+
+Bodies are encoded while they are sent: the first two chunks are encoded
+before the response starts, so errors in them still make a 500 response,
+while an error in a later chunk cuts the body short after the 200 status.
+"""
+from itertools import chain
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.renderers import JSON, JSONP_VALID_CALLBACK
+
+from openregistry.api.codec import get_codec
+
+CHUNK_SIZE = 64 * 1024
+LIST_BATCH = 100
+
+
+def iter_json(value, dumps, depth=2):
+    """
+    Yields JSON of ``value`` in pieces, the same as ``dumps`` without indent
+    would give: dicts and lists ``depth`` levels deep are split into elements
+    encoded by ``dumps``.
+    """
+    if depth and isinstance(value, dict) and value and all([isinstance(i, basestring) for i in value]):
+        separator = '{'
+        for key, item in value.items():
+            yield separator + dumps(key) + ': '
+            for piece in iter_json(item, dumps, depth - 1):
+                yield piece
+            separator = ', '
+        yield '}'
+    elif depth == 1 and (isinstance(value, list) or type(value) is tuple) and value:
+        # elements are encoded in batches, encoding each one costs more than the encoding itself
+        separator = '['
+        for i in range(0, len(value), LIST_BATCH):
+            yield separator + dumps(list(value[i:i + LIST_BATCH]))[1:-1]
+            separator = ', '
+        yield ']'
+    elif depth and (isinstance(value, list) or type(value) is tuple) and value:
+        separator = '['
+        for item in value:
+            yield separator
+            for piece in iter_json(item, dumps, depth - 1):
+                yield piece
+            separator = ', '
+        yield ']'
+    else:
+        yield dumps(value)
+
+
+def iter_chunks(pieces, chunk_size=CHUNK_SIZE):
+    chunk, size = [], 0
+    for piece in pieces:
+        chunk.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def collapse(chunks):
+    """ Single string if ``chunks`` has one chunk, otherwise an iterable """
+    first = next(chunks, '')
+    second = next(chunks, None)
+    if second is None:
+        return first
+    return chain([first, second], chunks)
+
+
+class StreamingJSON(JSON):
+    """ Renderer producing the same output as ``JSON`` with ``codec`` in chunks """
+
+    def __init__(self, codec=None, adapters=(), chunk_size=CHUNK_SIZE, **kw):
+        self.codec = codec or get_codec()
+        super(StreamingJSON, self).__init__(self.codec.dumps, adapters, **kw)
+        self.chunk_size = chunk_size
+
+    def iter_pieces(self, value, request):
+        default = self._make_default(request)
+        if self.kw:
+            # indented or sorted output is not split into elements, the codec yields it piece by piece
+            return self.codec.iterencoder(default, **self.kw)(value)
+        return iter_json(value, self.codec.encoder(default))
+
+    def set_content_type(self, request, content_type):
+        if request is not None:
+            response = request.response
+            if response.content_type == response.default_content_type:
+                response.content_type = content_type
+
+    def __call__(self, info):
+        def _render(value, system):
+            request = system.get('request')
+            self.set_content_type(request, 'application/json')
+            return collapse(iter_chunks(self.iter_pieces(value, request), self.chunk_size))
+        return _render
+
+
+class StreamingJSONP(StreamingJSON):
+    """ Renderer producing the same output as ``JSONP`` in chunks """
+
+    def __init__(self, param_name='callback', **kw):
+        super(StreamingJSONP, self).__init__(**kw)
+        self.param_name = param_name
+
+    def __call__(self, info):
+        def _render(value, system):
+            request = system.get('request')
+            pieces = self.iter_pieces(value, request)
+            content_type = 'application/json'
+            callback = request.GET.get(self.param_name) if request is not None else None
+            if callback is not None:
+                if not JSONP_VALID_CALLBACK.match(callback):
+                    raise HTTPBadRequest('Invalid JSONP callback function name.')
+                content_type = 'application/javascript'
+                pieces = chain([str('/**/{0}('.format(callback))], pieces, [');'])
+            self.set_content_type(request, content_type)
+            return collapse(iter_chunks(pieces, self.chunk_size))
+        return _render
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from itertools import count
+from logging import getLogger
+from gevent import spawn, sleep
+
+LOGGER = getLogger(__name__)
+
+
+def replication_lag(tasks, db_name):
+    """
+    Returns the largest lag of replication tasks writing into ``db_name``
+    or None if there are no such tasks.
+    """
+    lags = [
+        task['source_seq'] - task['checkpointed_source_seq']
+        for task in tasks
+        if task.get('type') == 'replication' and task.get('target', '').rstrip('/').split('/')[-1] == db_name
+    ]
+    return max(lags) if lags else None
+
+
+class ReplicaRouter(object):
+    """
+    Routes safe requests to read-only replicas of the database.
+
+    Replicas are checked every ``interval`` seconds in the background: a
+    replica is healthy when its server reports replication tasks into the
+    replica database lagging by at most ``threshold`` sequence numbers.
+    Healthy replicas are picked round-robin, None means the primary.
+    """
+
+    def __init__(self, replicas, threshold, interval=5):
+        self.replicas = replicas
+        self.threshold = threshold
+        self.interval = interval
+        self.healthy = []
+        self.lags = {}
+        self._counter = count()
+        self._greenlet = None
+
+    def check(self):
+        healthy = []
+        for server, db in self.replicas:
+            try:
+                lag = replication_lag(server.tasks(), db.name)
+            except Exception as e:
+                LOGGER.warning('Error on checking replica {}: {}'.format(db.resource.url, e),
+                               extra={'MESSAGE_ID': 'replica_check_error'})
+                lag = None
+            self.lags[db.resource.url] = lag
+            if lag is not None and lag <= self.threshold:
+                healthy.append(db)
+        self.healthy = healthy
+
+    def _run(self):
+        while True:
+            self.check()
+            sleep(self.interval)
+
+    def start(self):
+        if self._greenlet is None or self._greenlet.dead:
+            self.check()
+            self._greenlet = spawn(self._run)
+
+    def stop(self):
+        if self._greenlet is not None:
+            self._greenlet.kill()
+            self._greenlet = None
+
+    def choose(self):
+        healthy = self.healthy
+        if healthy:
+            return healthy[next(self._counter) % len(healthy)]
+
+    def stats(self):
+        healthy = set([db.resource.url for db in self.healthy])
+        return dict([
+            (url, {'lag': lag, 'healthy': url in healthy})
+            for url, lag in self.lags.items()
+        ])
+
+
+def read_db(request):
+    """ Database to read from: a healthy replica for safe requests, the primary otherwise """
+    registry = request.registry
+    router = getattr(registry, 'replica_router', None)
+    if router is None or request.method not in ('GET', 'HEAD'):
+        return registry.db
+    return router.choose() or registry.db
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Revision history stored outside of resource documents.
+
+Older revisions of a resource are moved into append-only segment documents
+``<resource id>-revisions-<index of the first revision>`` and only the most
+recent ones stay inline. Sizes of the moved segments are kept in the
+``revisionSegments`` field of the resource, so any page of the history is
+read with the segment documents it spans only.
+
+Snapshots ``<resource id>-snapshot-<number of revisions>`` of full resource
+states written every few revisions let past states be rebuilt from the
+nearest snapshot instead of the current state.
+"""
+from copy import deepcopy
+from jsonpatch import apply_patch
+from couchdb.http import ResourceConflict
+
+from openregistry.api.models.dates import parse_date
+
+SEGMENT_DOC_TYPE = 'RevisionsSegment'
+SNAPSHOT_DOC_TYPE = 'RevisionsSnapshot'
+
+
+def segment_id(resource_id, start):
+    return '{}-revisions-{}'.format(resource_id, start)
+
+
+class RevisionStore(object):
+    """
+    Keeps at most ``window`` + ``segment_size`` revisions inline, moving older
+    ones to segments of ``segment_size`` revisions.
+    """
+
+    def __init__(self, db, window=100, segment_size=100, snapshot_interval=0):
+        self.db = db
+        self.window = window
+        self.segment_size = segment_size
+        self.snapshot_interval = snapshot_interval
+
+    def offload(self, item):
+        """
+        Writes segments of old revisions of ``item`` and removes them from it.
+        Must be called before saving the item, returns the number of moved revisions.
+        """
+        revisions = item.revisions
+        count = max(len(revisions) - self.window, 0) // self.segment_size
+        if not count:
+            return 0
+        segments = list(item.revisionSegments or [])
+        start = sum(segments)
+        docs = []
+        for i in range(count):
+            chunk = revisions[i * self.segment_size:(i + 1) * self.segment_size]
+            docs.append({
+                '_id': segment_id(item.id, start),
+                'doc_type': SEGMENT_DOC_TYPE,
+                'resource_id': item.id,
+                'start': start,
+                'revisions': [j.to_primitive() for j in chunk],
+            })
+            segments.append(len(chunk))
+            start += len(chunk)
+        for success, doc_id, result in self.db.update(docs):
+            # segments never change, a conflict means one was written by an earlier attempt
+            if not success and not isinstance(result, ResourceConflict):
+                raise result
+        moved = count * self.segment_size
+        item.revisions = revisions[moved:]
+        item.revisionSegments = segments
+        return moved
+
+    def checkpoint(self, item):
+        """
+        Writes a snapshot of ``item`` every ``snapshot_interval`` revisions.
+        Must be called after saving the item, so that only stored states are kept.
+        """
+        index = count_revisions(item)
+        if not self.snapshot_interval or not index or index % self.snapshot_interval:
+            return False
+        try:
+            self.db.save({
+                '_id': snapshot_id(item.id, index),
+                'doc_type': SNAPSHOT_DOC_TYPE,
+                'resource_id': item.id,
+                'rev': item.rev,
+                'dateModified': item.dateModified and item.dateModified.isoformat(),
+                'data': item.serialize('plain'),
+            })
+        except ResourceConflict:
+            return False
+        return True
+
+
+def count_revisions(item):
+    return sum(item.revisionSegments or []) + len(item.revisions)
+
+
+def load_segment(item, start, load):
+    doc = load(segment_id(item.id, start))
+    if doc is None:
+        raise KeyError(segment_id(item.id, start))
+    return doc['revisions']
+
+
+def get_revisions(item, load, offset=0, limit=100):
+    """
+    Revisions of ``item`` from ``offset`` to ``offset + limit``, oldest first.
+    ``load`` returns raw documents by id.
+    """
+    end = offset + limit
+    revisions = []
+    start = 0
+    for size in item.revisionSegments or []:
+        if start < end and start + size > offset:
+            revisions.extend(load_segment(item, start, load)[max(offset - start, 0):end - start])
+        start += size
+    inline = item.revisions[max(offset - start, 0):max(end - start, 0)]
+    revisions.extend([i.to_primitive() for i in inline])
+    return revisions
+
+
+class RevisionHistory(object):
+    """
+    All revisions of ``item`` indexed from the oldest one, segments are
+    loaded on first access.
+    """
+
+    def __init__(self, item, load):
+        self.item = item
+        self.load = load
+        self.segments = []
+        start = 0
+        for size in item.revisionSegments or []:
+            self.segments.append((start, size))
+            start += size
+        self.offloaded = start
+        self.loaded = {}
+
+    def __len__(self):
+        return self.offloaded + len(self.item.revisions)
+
+    def __getitem__(self, index):
+        if index >= self.offloaded:
+            return self.item.revisions[index - self.offloaded].to_primitive()
+        start = max([i for i, _ in self.segments if i <= index])
+        if start not in self.loaded:
+            self.loaded[start] = load_segment(self.item, start, self.load)
+        return self.loaded[start][index - start]
+
+    def bisect(self, key, value):
+        """ Number of revisions with ``key(revision) <= value``, keys grow with revisions """
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if value < key(self[middle]):
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+
+def parse_generation(rev):
+    """ Number of updates from the CouchDB revision, None if it is invalid """
+    generation = rev.split('-', 1)[0] if rev else '0'
+    return int(generation) if generation.isdigit() else None
+
+
+def rev_generation(revision):
+    return parse_generation(revision.get('rev'))
+
+
+def revision_date(revision):
+    return parse_date(revision['date'])
+
+
+def snapshot_id(resource_id, index):
+    return '{}-snapshot-{}'.format(resource_id, index)
+
+
+def get_state(item, load, rev=None, date=None, snapshot_interval=0):
+    """
+    Plain state of ``item`` as of its CouchDB revision ``rev`` or as of
+    ``date`` (a datetime), None if the history has no such state.
+
+    Revision changes turn a resource back into its state before the change,
+    so they are applied from the nearest later snapshot (or the current state)
+    back to the requested state. With ``snapshot_interval`` snapshots written
+    every that many revisions bound the number of applied changes.
+    """
+    history = RevisionHistory(item, load)
+    total = len(history)
+    if rev is not None:
+        if rev == item.rev:
+            return item.serialize('plain')
+        generation = parse_generation(rev)
+        index = history.bisect(rev_generation, generation) - 1 if generation is not None else -1
+        if index < 0 or history[index].get('rev') != rev:
+            return None
+    else:
+        # the state after the last change made by ``date``
+        index = history.bisect(revision_date, date)
+        if not index:
+            return None
+    base, state = total, None
+    if snapshot_interval:
+        base = -(-index // snapshot_interval) * snapshot_interval
+        if base < total:
+            snapshot = load(snapshot_id(item.id, base))
+            # a snapshot is valid if the next change was made from its revision
+            if snapshot is not None and snapshot['rev'] == history[base].get('rev'):
+                # loaded documents may be shared by the document cache
+                state = deepcopy(snapshot['data'])
+    if state is None:
+        base, state = total, item.serialize('plain')
+    for i in reversed(range(index, base)):
+        state = apply_patch(state, deepcopy(history[i]['changes']), in_place=True)
+    return state
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 from pyramid.events import subscriber
-from pyramid.events import NewRequest, BeforeRender, ContextFound
+from pyramid.events import NewRequest, NewResponse, BeforeRender, ContextFound
 from openregistry.api.constants import VERSION
-from openregistry.api.utils import get_now, update_logging_context, fix_url
+from openregistry.api.events import DatabaseChangesEvent
+from openregistry.api.utils import get_now, update_logging_context, fix_url, json_body_lookup
 
 
 @subscriber(NewRequest)
@@ -43,11 +44,10 @@ def set_logging_context(event):
 def set_renderer(event):
     request = event.request
 
-    try:
-        json = request.json_body
-    except ValueError:
-        json = {}
-    pretty = isinstance(json, dict) and json.get('options', {}).get('pretty') or request.params.get('opt_pretty')
+    pretty = request.params.get('opt_pretty')
+    if not pretty:
+        json = json_body_lookup(request, 'options')
+        pretty = json and json.get('options', {}).get('pretty')
     jsonp = request.params.get('opt_jsonp')
     if jsonp and pretty:
         request.override_renderer = 'prettyjsonp'
@@ -64,3 +64,40 @@ def set_renderer(event):
 def beforerender(event):
     if event.rendering_val and isinstance(event.rendering_val, dict) and 'data' in event.rendering_val:
         fix_url(event.rendering_val['data'], event['request'].application_url)
+
+
+@subscriber(BeforeRender)
+def set_etag(event):
+    request = event['request']
+    etag = getattr(request, 'response_etag', None)
+    if etag and request.method in ('GET', 'HEAD'):
+        request.response.etag = etag
+
+
+@subscriber(NewResponse)
+def invalidate_written_documents(event):
+    """ Drops documents the request may have written, the changes feed may not catch up before the next read """
+    written = event.request.__dict__.get('written_documents')
+    cache = getattr(event.request.registry, 'document_cache', None)
+    if written and cache is not None:
+        for doc_id in written:
+            cache.invalidate(doc_id)
+
+
+@subscriber(DatabaseChangesEvent)
+def invalidate_document_cache(event):
+    cache = getattr(event.registry, 'document_cache', None)
+    if cache is None:
+        return
+    for change in event.results:
+        cache.invalidate(change['id'], change['changes'][-1]['rev'] if change.get('changes') else None)
+
+
+@subscriber(NewResponse)
+def set_couchdb_timing(event):
+    timing = getattr(event.request, 'couchdb_timing', None)
+    if not timing:
+        return
+    calls, duration = timing
+    event.response.headers['Server-Timing'] = 'couchdb;dur={:.1f};desc="{} calls"'.format(duration * 1000, calls)
+    update_logging_context(event.request, {'COUCHDB_CALLS': calls, 'COUCHDB_TIME': '{:.4f}'.format(duration)})
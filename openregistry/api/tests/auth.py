@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
+import shutil
+import tempfile
 import unittest
+from hashlib import sha512
+from mock import patch
 from pyramid import testing
-from openregistry.api.auth import AuthenticationPolicy
+from openregistry.api.auth import AuthenticationPolicy, load_users
 from pyramid.tests.test_authentication import TestBasicAuthAuthenticationPolicy
 import os
 
@@ -22,10 +26,79 @@ class AuthTest(TestBasicAuthAuthenticationPolicy):
         policy = self._makeOne(None)
         self.assertEqual(policy.unauthenticated_userid(request), 'chrisr')
 
+    def test_users_cache(self):
+        policy = self._makeOne(None)
+        with patch('openregistry.api.auth.sha512', side_effect=sha512) as hasher:
+            for token in ['chrisr', 'chrisr', 'unknown', 'unknown']:
+                request = testing.DummyRequest()
+                request.headers['Authorization'] = 'Bearer {}'.format(token)
+                policy.unauthenticated_userid(request)
+                policy.callback(None, request)
+            self.assertEqual(hasher.call_count, 2)
+        self.assertEqual(policy.users_cache.stats()['hits'], 2)
+        self.assertIs(policy.users_cache.get('Bearer unknown'), False)
+
+    def test_effective_principals(self):
+        policy = self._makeOne(None)
+        request = testing.DummyRequest(params={'acc_token': 'token'})
+        request.headers['Authorization'] = 'Bearer chrisr'
+        principals = policy.effective_principals(request)
+        self.assertIn('g:tests', principals)
+        self.assertIn('chrisr_{}'.format(sha512('token').hexdigest()), principals)
+        principals.append('g:admins')
+        with patch.object(policy, 'callback') as callback:
+            self.assertNotIn('g:admins', policy.effective_principals(request))
+            self.assertFalse(callback.called)
+        self.assertEqual(policy.hash_token('token'), sha512('token').hexdigest())
+        self.assertEqual(policy.tokens_cache.stats()['hits'], 1)
+
+
+class AuthReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.auth_file = os.path.join(self.tmpdir, 'auth.ini')
+        shutil.copy(os.path.join(dir_path, 'auth.ini'), self.auth_file)
+        self.policy = AuthenticationPolicy(self.auth_file, 'SomeRealm')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def request(self, token):
+        request = testing.DummyRequest()
+        request.headers['Authorization'] = 'Bearer {}'.format(token)
+        return request
+
+    def write(self, content, mtime):
+        with open(self.auth_file, 'w') as f:
+            f.write(content)
+        os.utime(self.auth_file, (mtime, mtime))
+
+    def test_reload(self):
+        self.assertFalse(self.policy.reload())
+        self.assertEqual(self.policy.unauthenticated_userid(self.request('broker')), None)
+
+        self.write('[brokers]\nbroker = {},3\n'.format(sha512('broker').hexdigest()), 1000)
+        self.assertTrue(self.policy.reload())
+        self.assertEqual(self.policy.unauthenticated_userid(self.request('broker')), 'broker')
+        self.assertEqual(self.policy.unauthenticated_userid(self.request('chrisr')), None)
+        self.assertEqual(self.policy.users, load_users(self.auth_file))
+        self.assertFalse(self.policy.reload())
+
+    def test_reload_invalid(self):
+        users = self.policy.users
+        self.write('broker = broker\n', 1000)
+        self.assertFalse(self.policy.reload())
+        self.assertIs(self.policy.users, users)
+        os.remove(self.auth_file)
+        self.assertFalse(self.policy.reload())
+        self.assertEqual(self.policy.unauthenticated_userid(self.request('chrisr')), 'chrisr')
+
 
 def suite():
     tests = unittest.TestSuite()
     tests.addTest(unittest.makeSuite(AuthTest))
+    tests.addTest(unittest.makeSuite(AuthReloadTest))
     return tests
 
 
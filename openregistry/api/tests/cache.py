@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import unittest
+from couchdb.http import ResourceNotFound
+from mock import Mock, patch
+from pyramid import testing
+
+from openregistry.api.cache import LRUCache, TTLCache, DocumentCache
+from openregistry.api.subscribers import invalidate_written_documents
+from openregistry.api.traversal import get_document
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_entries_limit(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('b', 'missing'), 'missing')
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_size_limit(self):
+        cache = LRUCache(10, 10)
+        cache.set('a', 1, 4)
+        cache.set('b', 2, 4)
+        cache.set('a', 3, 5)
+        self.assertEqual(cache.size, 9)
+        cache.set('c', 4, 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.size, 8)
+        cache.set('d', 5, 11)
+        self.assertNotIn('d', cache)
+        self.assertEqual(cache.pop('a'), 3)
+        self.assertEqual(cache.size, 3)
+        cache.clear()
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+
+class TTLCacheTest(unittest.TestCase):
+
+    @patch('openregistry.api.cache.time')
+    def test_expiration(self, time):
+        time.return_value = 100
+        cache = TTLCache(10, 60)
+        cache.set('a', 1)
+        cache.set('b', False)
+        time.return_value = 159
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIs(cache.get('b'), False)
+        time.return_value = 160
+        self.assertIsNone(cache.get('a'))
+        self.assertNotIn('a', cache)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+
+class DocumentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = DocumentCache(10)
+        self.db = Mock()
+        self.db.name = 'tests'
+        self.doc = {'_id': 'a', '_rev': '1-a', 'status': 'draft'}
+        self.db.resource.get_json.return_value = (200, {'Content-Length': '50'}, self.doc)
+        self.db.resource.head.return_value = (200, {'ETag': '"1-a"'}, None)
+
+    def test_load(self):
+        doc = self.cache.load(self.db, 'a')
+        self.assertEqual(doc, self.doc)
+        self.assertEqual(self.cache.size, 50)
+        doc['status'] = 'pending'
+        self.assertEqual(self.cache.load(self.db, 'a'), self.doc)
+        self.assertEqual(self.db.resource.get_json.call_count, 1)
+        self.assertEqual(self.db.resource.head.call_count, 1)
+
+        self.db.resource.head.return_value = (200, {'ETag': '"2-b"'}, None)
+        self.cache.load(self.db, 'a')
+        self.assertEqual(self.db.resource.get_json.call_count, 2)
+        self.assertEqual(self.cache.stats()['stale'], 1)
+
+    def test_load_trusted(self):
+        self.cache.validate = 'changes'
+        self.cache.load(self.db, 'a')
+        self.cache.load(self.db, 'a', trusted=True)
+        self.assertEqual(self.db.resource.head.call_count, 0)
+        self.cache.invalidate('a', '1-a')
+        self.assertIn('a', self.cache)
+        self.cache.invalidate('a', '2-b')
+        self.assertNotIn('a', self.cache)
+
+    def test_load_not_found(self):
+        self.db.resource.get_json.side_effect = ResourceNotFound()
+        self.assertIsNone(self.cache.load(self.db, 'a'))
+
+    def test_load_other_db(self):
+        self.cache.load(self.db, 'a')
+        self.db.name = 'other'
+        self.cache.load(self.db, 'a')
+        self.assertEqual(self.db.resource.get_json.call_count, 2)
+
+    def make_request(self, registry, method='GET'):
+        request = testing.DummyRequest(read_db=self.db, method=method)
+        request.registry = registry
+        return request
+
+    def test_read_own_writes(self):
+        self.cache.validate = 'changes'
+        registry = Mock(spec=['db', 'document_cache', 'changes_watcher'], db=self.db, document_cache=self.cache)
+        registry.changes_watcher.failures = 0
+        request = self.make_request(registry)
+        get_document(request, 'a')
+        get_document(request, 'a')
+        self.assertEqual(self.db.resource.head.call_count, 0)
+
+        request = self.make_request(registry, 'PATCH')
+        get_document(request, 'a')
+        self.assertEqual(self.db.resource.head.call_count, 1)
+        # saved by the request, the changes feed is behind
+        self.doc = dict(self.doc, _rev='2-b', status='pending')
+        self.db.resource.get_json.return_value = (200, {}, self.doc)
+        invalidate_written_documents(Mock(request=request))
+
+        request = self.make_request(registry)
+        self.assertEqual(get_document(request, 'a')['status'], 'pending')
+
+
+def suite():
+    tests = unittest.TestSuite()
+    tests.addTest(unittest.makeSuite(LRUCacheTest))
+    tests.addTest(unittest.makeSuite(TTLCacheTest))
+    tests.addTest(unittest.makeSuite(DocumentCacheTest))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import unittest
+from gevent import spawn_later, GreenletExit
+from mock import Mock, patch
+
+from openregistry.api.changes import ChangesWatcher
+
+
+class ChangesWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.watcher = ChangesWatcher(Mock())
+        self.watcher._greenlet = Mock(dead=False)
+        self.watcher.last_seq = 5
+
+    def test_wait(self):
+        self.assertTrue(self.watcher.wait(4, 0))
+        self.assertFalse(self.watcher.wait(5, 0))
+        self.assertTrue(self.watcher.wait(None, 0))
+
+        # CouchDB 2.x sequences
+        self.watcher.last_seq = '12-g1AAAAFTeJzLYWBg4MhgTmHgz8tPSTV0MDQy'
+        self.assertTrue(self.watcher.wait('9-g1AAAAFTeJzLYWBg4MhgTmHgz8tPSTV0MDQy', 0))
+        self.assertFalse(self.watcher.wait('12-g1AAAAFTeJzLYWBg4MhgTmHgz8tPSTV0MDQy', 0))
+        self.assertFalse(self.watcher.wait('100-g1AAAAFTeJzLYWBg4MhgTmHgz8tPSTV0MDQy', 0))
+
+    def test_notify(self):
+        spawn_later(0.01, self.watcher.notify, 6)
+        self.assertTrue(self.watcher.wait(5, 1))
+        self.assertEqual(self.watcher.last_seq, 6)
+        self.assertFalse(self.watcher.wait(6, 0.01))
+
+    def test_start(self):
+        watcher = ChangesWatcher(Mock(**{'info.return_value': {'update_seq': 10}}))
+        watcher._run = Mock()
+        self.assertEqual(watcher.start(), 10)
+        watcher.stop()
+        self.assertIsNone(watcher._greenlet)
+
+    @patch('openregistry.api.changes.sleep')
+    def test_run(self, mock_sleep):
+        registry = Mock()
+        db = Mock()
+        db.changes.side_effect = [
+            ValueError('down'),
+            {'results': [], 'last_seq': 5},
+            {'results': [{'seq': 7, 'id': 'a', 'changes': [{'rev': '1-a'}]}], 'last_seq': 7},
+            GreenletExit()
+        ]
+        watcher = ChangesWatcher(db, registry=registry)
+        watcher.last_seq = 5
+        with self.assertRaises(GreenletExit):
+            watcher._run()
+
+        self.assertEqual(mock_sleep.call_count, 1)
+        self.assertLessEqual(mock_sleep.call_args[0][0], watcher.backoff)
+        self.assertEqual(watcher.errors, 1)
+        self.assertEqual(watcher.failures, 0)
+        self.assertEqual(watcher.last_seq, 7)
+        self.assertEqual(registry.notify.call_count, 1)
+        event = registry.notify.call_args[0][0]
+        self.assertEqual(event.results[0]['id'], 'a')
+        self.assertEqual(event.last_seq, 7)
+
+    def test_stats(self):
+        self.watcher.db.info.return_value = {'update_seq': 8}
+        stats = self.watcher.stats()
+        self.assertEqual(stats['lag'], 3)
+        self.assertTrue(stats['running'])
+        self.assertIsNone(stats['since_last_poll'])
+
+
+def suite():
+    tests = unittest.TestSuite()
+    tests.addTest(unittest.makeSuite(ChangesWatcherTest))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
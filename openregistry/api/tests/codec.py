@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import sys
+import unittest
+from decimal import Decimal
+from timeit import timeit
+import simplejson
+
+from openregistry.api.codec import CODECS, get_codec, SimpleJSONCodec
+from openregistry.api.tests.blanks import json_data
+
+
+def registry_documents():
+    """ Test resources as they are stored, with amounts and non-ASCII text """
+    documents = []
+    for name in sorted(dir(json_data)):
+        value = getattr(json_data, name)
+        if name.startswith('test_') and isinstance(value, dict):
+            documents.append(dict(value, value={'amount': Decimal('100500.01'), 'currency': u'UAH'},
+                                  title=u'Земельна ділянка', doc_type='Asset'))
+    return documents
+
+
+class Unknown(object):
+    pass
+
+
+class CodecConformanceTest(unittest.TestCase):
+    """ Behaviour every codec shares with simplejson and ``parse_float=Decimal`` """
+
+    codec_name = SimpleJSONCodec.name
+
+    def setUp(self):
+        self.codec = get_codec(self.codec_name)
+
+    def test_loads_decimals(self):
+        data = self.codec.loads(u'{"amount": 100.10, "rate": 1e-3, "big": 0.1000000000000000055511151231257827, '
+                                u'"count": 12345678901234567890, "negative": -0.0}')
+        self.assertEqual(data, {
+            'amount': Decimal('100.10'), 'rate': Decimal('1e-3'), 'big': Decimal('0.1000000000000000055511151231257827'),
+            'count': 12345678901234567890, 'negative': Decimal('-0.0'),
+        })
+        self.assertIsInstance(data['amount'], Decimal)
+        self.assertEqual(str(data['amount']), '100.10')
+        self.assertIsInstance(data['count'], (int, long))
+
+    def test_loads_text(self):
+        data = self.codec.loads(u'{"title": "Земля", "id": "a\\u0431\\n", "list": [true, false, null]}')
+        self.assertEqual(data, {u'title': u'Земля', u'id': u'aб\n', u'list': [True, False, None]})
+        self.assertTrue(all([isinstance(i, unicode) for i in data]))
+        self.assertIsInstance(data['title'], unicode)
+
+    def test_loads_invalid(self):
+        for text in (u'', u'{', u'{"a": 1,}', u"{'a': 1}", u'[1] 2'):
+            with self.assertRaises(ValueError):
+                self.codec.loads(text)
+
+    def test_dumps(self):
+        for value in registry_documents() + [[], {}, u'Земля', Decimal('0.10'), [None, 1.5, True]]:
+            self.assertEqual(self.codec.dumps(value), simplejson.dumps(value))
+            self.assertIsInstance(self.codec.dumps(value), str)
+        self.assertEqual(self.codec.dumps({'amount': Decimal('100.10')}), '{"amount": 100.10}')
+        with self.assertRaises(TypeError):
+            self.codec.dumps(Unknown())
+        default = lambda obj: 'unknown'
+        self.assertEqual(self.codec.dumps([Unknown()], default), '["unknown"]')
+        self.assertEqual(self.codec.encoder(default)([Unknown()]), '["unknown"]')
+        self.assertEqual(self.codec.encoder()([u'Земля']), simplejson.dumps([u'Земля']))
+        for value in registry_documents()[:2]:
+            self.assertEqual(''.join(self.codec.iterencoder(default, indent=4)(dict(value, unknown=Unknown()))),
+                             simplejson.dumps(dict(value, unknown=Unknown()), default=default, indent=4))
+
+    def test_dumps_document(self):
+        for value in registry_documents():
+            text = self.codec.dumps_document(value)
+            self.assertEqual(text, simplejson.dumps(value, allow_nan=False, ensure_ascii=False))
+            self.assertIn(u'Земельна ділянка', text)
+            self.assertIn('"amount": 100500.01', text)
+            self.assertEqual(self.codec.loads(text), value)
+        with self.assertRaises(ValueError):
+            self.codec.dumps_document({'amount': float('nan')})
+
+    def test_round_trip(self):
+        text = u'{"value": {"amount": 1000.000}, "title": ["Земля", 1, null]}'
+        data = self.codec.loads(text)
+        self.assertEqual(self.codec.dumps_document(data['value']), u'{"amount": 1000.000}')
+        self.assertEqual(self.codec.dumps_document(data['title']), u'["Земля", 1, null]')
+        self.assertEqual(self.codec.loads(self.codec.dumps(data)), data)
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_get_codec(self):
+        self.assertIsInstance(get_codec(), SimpleJSONCodec)
+        self.assertIsInstance(get_codec('simplejson'), SimpleJSONCodec)
+        self.assertIsInstance(get_codec('openregistry.api.codec.SimpleJSONCodec'), SimpleJSONCodec)
+        with self.assertRaises(ImportError):
+            get_codec('unknown')
+
+
+def benchmark(number=2000):
+    """ Prints decoding and encoding times of registry documents for each codec """
+    documents = registry_documents()
+    texts = [simplejson.dumps(i, ensure_ascii=False) for i in documents]
+    cases = [('simplejson calls', lambda text: simplejson.loads(text, parse_float=Decimal),
+              lambda value: simplejson.dumps(value, allow_nan=False, ensure_ascii=False))]
+    for name in sorted(CODECS):
+        codec = get_codec(name)
+        cases.append((name, codec.loads, codec.dumps_document))
+    for name, loads, dumps in cases:
+        decode = timeit(lambda: [loads(i) for i in texts], number=number)
+        encode = timeit(lambda: [dumps(i) for i in documents], number=number)
+        print '{:20} decode {:.3f}s encode {:.3f}s'.format(name, decode, encode)
+
+
+def suite():
+    tests = unittest.TestSuite()
+    for name in sorted(CODECS):
+        case = type('{}ConformanceTest'.format(CODECS[name].__name__), (CodecConformanceTest,), {'codec_name': name})
+        tests.addTest(unittest.makeSuite(case))
+    tests.addTest(unittest.makeSuite(CodecTest))
+    return tests
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        unittest.main(defaultTest='suite')
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import unittest
+from copy import deepcopy
+from mock import Mock
+
+from openregistry.api.constants import CodeList, ClassificationCodes, CAV_CODES, CPV_CODES, IDENTIFIER_CODES
+
+
+class CodeListTest(unittest.TestCase):
+
+    def test_membership(self):
+        codes = CodeList([u'b', u'a'])
+        self.assertIn(u'a', codes)
+        self.assertIn('b', codes)
+        self.assertNotIn(u'c', codes)
+        self.assertNotIn({}, codes)
+        self.assertEqual(list(codes), [u'b', u'a'])
+        self.assertEqual(unicode(codes), u"[u'b', u'a']")
+        self.assertIn(u'UA-EDR', IDENTIFIER_CODES)
+
+    def test_list_api(self):
+        codes = CodeList([u'b', u'a'])
+        self.assertIsInstance(codes, list)
+        self.assertEqual(codes + [u'c'], [u'b', u'a', u'c'])
+        codes.append(u'c')
+        self.assertIn(u'c', codes)
+        codes.remove(u'b')
+        self.assertNotIn(u'b', codes)
+        codes.extend([u'd'])
+        codes += [u'e']
+        codes[0] = u'f'
+        self.assertEqual(codes, [u'f', u'c', u'd', u'e'])
+        self.assertIn(u'f', codes)
+        self.assertNotIn(u'a', codes)
+
+        codes = ClassificationCodes([u'39000000-2'])
+        self.assertEqual(codes.children(u'39000000-2'), [])
+        codes.append(u'39100000-3')
+        self.assertEqual(codes.children(u'39000000-2'), [u'39100000-3'])
+
+    def test_lazy_loading(self):
+        loader = Mock(return_value=[u'a', u'b'])
+        codes = CodeList(loader)
+        self.assertTrue(codes)
+        self.assertIs(deepcopy(codes), codes)
+        self.assertFalse(codes.loaded)
+        self.assertFalse(loader.called)
+        self.assertIn(u'b', codes)
+        self.assertEqual(codes[1:], [u'b'])
+        self.assertEqual(len(codes), 2)
+        self.assertEqual(codes, [u'a', u'b'])
+        self.assertEqual(loader.call_count, 1)
+        self.assertFalse(CodeList([]))
+        self.assertFalse(CPV_CODES.loaded)
+
+    def test_lazy_operations(self):
+        make = lambda: CodeList(lambda: [u'a', u'b', u'a'])
+        self.assertEqual(make() + [u'x'], [u'a', u'b', u'a', u'x'])
+        self.assertEqual([u'x'] + make(), [u'x', u'a', u'b', u'a'])
+        self.assertEqual(make() * 2, [u'a', u'b', u'a'] * 2)
+        self.assertEqual(2 * make(), [u'a', u'b', u'a'] * 2)
+        self.assertEqual(make().index(u'b'), 1)
+        self.assertEqual(make().count(u'a'), 2)
+        self.assertTrue(make() < [u'b'])
+        self.assertTrue(make() > [u'a'])
+        self.assertTrue(make() <= [u'a', u'b', u'a'])
+        self.assertEqual(make(), make())
+        self.assertEqual([u'a', u'b', u'a'], make())
+        self.assertEqual(list(reversed(make())), [u'a', u'b', u'a'])
+        self.assertEqual(repr(make()), repr([u'a', u'b', u'a']))
+        self.assertEqual(sorted(make()), [u'a', u'a', u'b'])
+        codes = make()
+        codes.append(u'c')
+        self.assertEqual(codes, [u'a', u'b', u'a', u'c'])
+        self.assertIn(u'c', codes)
+        self.assertEqual(len(CAV_CODES + [u'x']), len(CAV_CODES) + 1)
+        self.assertEqual(CAV_CODES.count(CAV_CODES[0]), 1)
+        self.assertEqual(CAV_CODES.index(CAV_CODES[3]), 3)
+
+    def test_hierarchy(self):
+        codes = ClassificationCodes([
+            u'39000000-2', u'39100000-3', u'39110000-6', u'39111000-3', u'39120000-9', u'10000000-1', u'14000000-1'
+        ])
+        self.assertEqual(codes.descendants(u'39100000-3'), [u'39110000-6', u'39111000-3', u'39120000-9'])
+        self.assertEqual(codes.children(u'39000000-2'), [u'39100000-3'])
+        self.assertEqual(codes.children(u'39100000-3'), [u'39110000-6', u'39120000-9'])
+        self.assertEqual(codes.parent(u'39111000-3'), u'39110000-6')
+        self.assertIsNone(codes.parent(u'39000000-2'))
+        self.assertEqual(codes.descendants(u'10000000-1'), [])
+        self.assertEqual(codes.descendants(u'391'), [u'39110000-6', u'39111000-3', u'39120000-9'])
+
+    def test_cav_codes(self):
+        self.assertIn(u'39513200-3', CAV_CODES)
+        self.assertEqual(CAV_CODES.parent(u'39513200-3'), u'39513000-1')
+        self.assertTrue(all([i.startswith(u'39') for i in CAV_CODES.descendants(u'39000000-2')]))
+
+
+def suite():
+    tests = unittest.TestSuite()
+    tests.addTest(unittest.makeSuite(CodeListTest))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from collections import namedtuple
+from itertools import chain, repeat
+from couchdb.design import ViewDefinition
+from couchdb.http import ResourceConflict, ResourceNotFound
+from mock import MagicMock, patch
+
+from openregistry.api import design
+from openregistry.api.design import (
+    add_projection, PROJECTIONS, PENDING_VIEWS, build_design_docs, diff_design_docs, deploy_design_docs, is_pending,
+    sync_design
+)
+
+Row = namedtuple('Row', ['id', 'doc'])
+
+VIEWS = [
+    ViewDefinition('dummies', 'all', 'function(doc) {emit(doc._id, null);}'),
+    ViewDefinition('dummies', 'by_dateModified', 'function(doc) {emit(doc.dateModified, null);}'),
+    ViewDefinition('others', 'all', 'function(doc) {emit(doc._id, null);}'),
+]
+
+
+class DesignDB(object):
+    """ Design documents of a database with views indexed up to ``index_seqs``, then up to the last one """
+
+    def __init__(self, docs=(), index_seqs=(10,)):
+        self.docs = dict([(i['_id'], dict(i, _rev='1-a')) for i in docs])
+        self.index_seqs = chain(index_seqs, repeat(index_seqs[-1]))
+        self.saved = []
+
+    def get(self, doc_id):
+        doc = self.docs.get(doc_id)
+        return dict(doc) if doc is not None else None
+
+    def save(self, doc):
+        current = self.docs.get(doc['_id'])
+        if (current and current['_rev']) != doc.get('_rev'):
+            raise ResourceConflict()
+        doc['_rev'] = '{}-a'.format(int(current['_rev'].split('-')[0]) + 1 if current else 1)
+        self.docs[doc['_id']] = dict(doc)
+        self.saved.append(doc['_id'])
+
+    def delete(self, doc):
+        current = self.docs.get(doc['_id'])
+        if current is None:
+            raise ResourceNotFound()
+        if current['_rev'] != doc['_rev']:
+            raise ResourceConflict()
+        del self.docs[doc['_id']]
+
+    def view(self, name, **kw):
+        if name.startswith('_all_docs'):
+            return [Row(i, j) for i, j in sorted(self.docs.items())]
+        return MagicMock()
+
+    def info(self):
+        return {'update_seq': 10}
+
+    def resource(self, *path):
+        if '_design/{}'.format(path[1]) not in self.docs:
+            raise ResourceNotFound()
+        resource = MagicMock()
+        resource.get_json.side_effect = lambda: (200, {}, {'view_index': {'update_seq': next(self.index_seqs)}})
+        return resource
+
+
+class ProjectionTest(unittest.TestCase):
+
+    def tearDown(self):
+        PROJECTIONS.clear()
+        for name in [i for i in vars(design) if i.startswith('dummies_')]:
+            delattr(design, name)
+
+    def test_add_projection(self):
+        add_projection('dummies', ['title', 'status'], "doc.doc_type == 'Dummy'", [u'', u'test'])
+
+        self.assertEqual(set(PROJECTIONS['dummies']), set([u'dateModified', u'changes']))
+        self.assertEqual(set(PROJECTIONS['dummies'][u'changes']), set([u'', u'test']))
+        fields, view = PROJECTIONS['dummies'][u'dateModified'][u'test'][0]
+        self.assertEqual(fields, frozenset(['title', 'status']))
+        self.assertEqual(view.design, 'dummies')
+        self.assertEqual(view.name, 'test_projection_status_title_by_dateModified')
+        self.assertIn("doc.mode === 'test'", view.map_fun)
+        self.assertIn('emit(doc.dateModified, data)', view.map_fun)
+        self.assertIs(getattr(design, 'dummies_test_projection_status_title_by_dateModified_view'), view)
+
+        fields, view = PROJECTIONS['dummies'][u'changes'][u''][0]
+        self.assertEqual(fields, frozenset(['title', 'status', 'dateModified']))
+        self.assertIn('emit(doc._local_seq, data)', view.map_fun)
+
+
+class SyncDesignTest(unittest.TestCase):
+
+    def test_build_design_docs(self):
+        docs = build_design_docs(VIEWS)
+        self.assertEqual(set(docs), set(['dummies', 'others']))
+        doc = docs['dummies']
+        self.assertEqual(doc['_id'], '_design/dummies')
+        self.assertEqual(set(doc['views']), set(['all', 'by_dateModified']))
+        self.assertEqual(doc['options'], {'local_seq': True})
+        self.assertEqual(doc['hash'], build_design_docs(VIEWS[::-1])['dummies']['hash'])
+        self.assertNotEqual(doc['hash'], build_design_docs(VIEWS[1:])['dummies']['hash'])
+
+    def test_diff_design_docs(self):
+        docs = build_design_docs(VIEWS)
+        old = build_design_docs(VIEWS[1:])['dummies']
+        old.update({'_rev': '1-a'})
+        old['views']['legacy'] = {'map': 'function(doc) {}'}
+        db = MagicMock()
+        db.view.return_value = [
+            Row('_design/dummies', old),
+            Row('_design/others', dict(docs['others'], _rev='1-b')),
+        ]
+        changed = diff_design_docs(db, docs)
+        self.assertEqual(len(changed), 1)
+        self.assertEqual(changed[0]['_id'], '_design/dummies')
+        self.assertEqual(changed[0]['_rev'], '1-a')
+        self.assertEqual(set(changed[0]['views']), set(['all', 'by_dateModified', 'legacy']))
+        self.assertEqual(changed[0]['hash'], docs['dummies']['hash'])
+
+        db.view.return_value = []
+        self.assertEqual(len(diff_design_docs(db, docs)), 2)
+
+    @patch('openregistry.api.design.spawn')
+    @patch('openregistry.api.design.get_views')
+    def test_sync_design(self, get_views, spawn):
+        get_views.return_value = VIEWS
+        db = MagicMock()
+        db.view.return_value = []
+        self.assertEqual(sync_design(db), ['_design/dummies', '_design/others'])
+        self.assertEqual(db.update.call_count, 1)
+        self.assertFalse(spawn.called)
+
+        self.assertEqual(sync_design(db, staged=True), ['_design/dummies', '_design/others'])
+        self.assertEqual(db.update.call_count, 1)
+        self.assertEqual(spawn.call_args[0][0], deploy_design_docs)
+
+        docs = build_design_docs(VIEWS)
+        db.view.return_value = [Row(i['_id'], i) for i in docs.values()]
+        self.assertEqual(sync_design(db), [])
+        self.assertEqual(db.update.call_count, 1)
+
+    @patch('openregistry.api.design.sleep')
+    def test_deploy_design_docs(self, sleep):
+        doc = build_design_docs(VIEWS)['dummies']
+        db = MagicMock()
+        db.get.return_value = None
+        db.info.return_value = {'update_seq': 10}
+        seqs = iter([5, 10])
+        db.resource.return_value.get_json.side_effect = lambda: (200, {}, {'view_index': {'update_seq': next(seqs)}})
+        deploy_design_docs(db, [doc])
+
+        staging = db.save.call_args_list[0][0][0]
+        self.assertEqual(staging['_id'], '_design/dummies_staging')
+        self.assertEqual(staging['views'], doc['views'])
+        self.assertEqual(db.view.call_args[0][0], 'dummies_staging/all')
+        self.assertEqual(db.view.call_args[1]['stale'], 'update_after')
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(db.save.call_args_list[1][0][0]['_id'], '_design/dummies')
+
+        db = DesignDB(index_seqs=[5, 10])
+        deploy_design_docs(db, [doc])
+        self.assertEqual(db.saved, ['_design/dummies_staging', '_design/dummies'])
+        self.assertEqual(set(db.docs), set(['_design/dummies']))
+        self.assertEqual(db.docs['_design/dummies']['hash'], doc['hash'])
+
+    @patch('openregistry.api.design.sleep')
+    def test_deploy_design_docs_concurrently(self, sleep):
+        docs = build_design_docs(VIEWS)
+        doc = docs['dummies']
+
+        # another version is being deployed
+        other = dict(build_design_docs(VIEWS[1:])['dummies'], _id='_design/dummies_staging')
+        db = DesignDB([other])
+        deploy_design_docs(db, [doc])
+        self.assertEqual(db.saved, [])
+        self.assertEqual(db.docs['_design/dummies_staging']['hash'], other['hash'])
+        self.assertNotIn('_design/dummies', db.docs)
+
+        # the same version is staged, then deployed by another process
+        db = DesignDB([dict(doc, _id='_design/dummies_staging')], index_seqs=[5])
+
+        def deploy_elsewhere(seconds):
+            db.docs['_design/dummies'] = dict(doc, _rev='1-b')
+            del db.docs['_design/dummies_staging']
+        sleep.side_effect = deploy_elsewhere
+        deploy_design_docs(db, [doc])
+        self.assertEqual(db.saved, [])
+        self.assertEqual(set(db.docs), set(['_design/dummies']))
+
+        # the real document is saved by another process right before this one
+        sleep.side_effect = None
+        db = DesignDB([dict(docs['others'], _id='_design/dummies')])
+        save = db.save
+
+        def save_concurrently(saved):
+            if saved['_id'] == '_design/dummies' and db.docs['_design/dummies']['hash'] != doc['hash']:
+                db.docs['_design/dummies'] = dict(doc, _rev='2-b')
+            save(saved)
+        db.save = save_concurrently
+        deploy_design_docs(db, [doc])
+        self.assertEqual(db.saved, ['_design/dummies_staging'])
+        self.assertEqual(set(db.docs), set(['_design/dummies']))
+
+        # the real document is changed to another version
+        db = DesignDB([dict(docs['others'], _id='_design/dummies')])
+
+        def save_other(saved):
+            if saved['_id'] == '_design/dummies':
+                db.docs['_design/dummies'] = dict(other, _id='_design/dummies', _rev='2-b')
+            save(saved)
+        save = db.save
+        db.save = save_other
+        deploy_design_docs(db, [doc])
+        self.assertEqual(db.docs['_design/dummies']['hash'], other['hash'])
+        self.assertIn('_design/dummies_staging', db.docs)
+
+    @patch('openregistry.api.design.spawn')
+    @patch('openregistry.api.design.get_views')
+    def test_pending_views(self, get_views, spawn):
+        get_views.return_value = VIEWS
+        db = DesignDB([build_design_docs(VIEWS[1:])['dummies']])
+        try:
+            sync_design(db, staged=True)
+            self.assertEqual(PENDING_VIEWS, set(['dummies/all', 'others/all']))
+            self.assertTrue(is_pending(VIEWS[0]))
+            self.assertFalse(is_pending(VIEWS[1]))
+            deploy_design_docs(db, spawn.call_args[0][2])
+            self.assertEqual(PENDING_VIEWS, set())
+        finally:
+            PENDING_VIEWS.clear()
+
+
+def suite():
+    tests = unittest.TestSuite()
+    tests.addTest(unittest.makeSuite(ProjectionTest))
+    tests.addTest(unittest.makeSuite(SyncDesignTest))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
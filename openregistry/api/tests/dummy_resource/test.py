@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 import os
+import json
 import unittest
 from pyramid import testing
 from mock import Mock, MagicMock, patch
 
 from paste.deploy.loadwsgi import appconfig
 
-from openregistry.api.tests.dummy_resource.views import DummyResource
+from openregistry.api.listing import Cursor
+from openregistry.api.tests.dummy_resource.views import DummyResource, VIEW_MAP, CHANGES_VIEW_MAP
 
 settings = appconfig('config:' + os.path.join(os.path.dirname(__file__), '..', 'tests.ini'))
 
@@ -36,6 +38,7 @@ class TestAPIResourceListing(BaseAPIUnitTest):
         self.request.registry.server_id = Mock()
         self.request.registry.couchdb_server = Mock()
         self.request.registry.update_after = True
+        self.request.read_db = self.request.registry.db
 
         self.context = Mock()
 
@@ -120,6 +123,140 @@ class TestAPIResourceListing(BaseAPIUnitTest):
             with self.assertRaises(OffsetExpired):
                 response = view.get()
 
+    def test_09_listing_cursor(self):
+
+        view = DummyResource(self.request, self.context)
+        self.request.params['offset'] = Cursor(u'2015-01-01T00:00:00+02:00', u'a', u'', u'', False).encode(view.cursor_secret)
+        VIEW_MAP[u''].reset_mock()
+        response = view.get()
+
+        self.assertEqual(response['data'], [])
+        self.assertEqual(response['next_page']['offset'], self.request.params['offset'])
+        self.assertEqual(VIEW_MAP[u''].call_args[1]['startkey'], u'2015-01-01T00:00:00+02:00')
+        self.assertEqual(VIEW_MAP[u''].call_args[1]['startkey_docid'], u'a\x00')
+        self.assertEqual(VIEW_MAP[u''].call_args[1]['limit'], 100)
+
+    def test_10_listing_cursor_mismatch(self):
+
+        self.request.errors = Mock(**{'add': Mock()})
+
+        view = DummyResource(self.request, self.context)
+        self.request.params['offset'] = Cursor(u'2015-01-01T00:00:00+02:00', u'a', u'test', u'', False).encode(view.cursor_secret)
+
+        class OffsetExpired(Exception):
+            """ Test exception for error_handler mocking"""
+
+        with patch('openregistry.api.utils.error_handler',
+                   return_value=OffsetExpired):
+            with self.assertRaises(OffsetExpired):
+                view.get()
+
+    def test_11_listing_stream(self):
+
+        self.request.params['stream'] = 'ndjson'
+        row = Mock(key=u'2015-01-01T00:00:00+02:00', id=u'a')
+        VIEW_MAP[u''].return_value = [row]
+
+        view = DummyResource(self.request, self.context)
+        try:
+            response = view.get()
+            self.assertEqual(response.content_type, 'application/x-ndjson')
+            lines = list(response.app_iter)
+        finally:
+            VIEW_MAP[u''].return_value = MagicMock()
+
+        self.assertTrue(lines[0].endswith('\n'))
+        self.assertEqual(json.loads(lines[0]), {'id': 'a', 'dateModified': '2015-01-01T00:00:00+02:00'})
+        self.assertIn('next_page', json.loads(lines[-1]))
+        self.assertEqual(VIEW_MAP[u''].call_args[1]['limit'], 1000)
+
+    def test_12_listing_stream_format_error(self):
+
+        self.request.errors = Mock(**{'add': Mock()})
+        self.request.params['stream'] = 'xml'
+
+        view = DummyResource(self.request, self.context)
+
+        class StreamError(Exception):
+            """ Test exception for error_handler mocking"""
+
+        with patch('openregistry.api.utils.error_handler',
+                   return_value=StreamError):
+            with self.assertRaises(StreamError):
+                view.get()
+
+    def test_13_listing_longpoll(self):
+
+        self.request.params['feed'] = 'changes'
+        self.request.params['longpoll'] = '1'
+        self.request.params['timeout'] = '1'
+        self.request.registry.longpoll_timeout = 30
+        self.request.registry.changes_watcher = watcher = Mock(last_seq=2)
+        watcher.start.return_value = 1
+        watcher.wait.side_effect = [True, False]
+        CHANGES_VIEW_MAP[u''].reset_mock()
+
+        view = DummyResource(self.request, self.context)
+        response = view.get()
+
+        self.assertEqual(response['data'], [])
+        self.assertIn('longpoll=1', response['next_page']['path'])
+        self.assertEqual(watcher.wait.call_count, 2)
+        self.assertEqual(watcher.wait.call_args_list[0][0][0], 1)
+        self.assertEqual(watcher.wait.call_args_list[1][0][0], 2)
+        self.assertLessEqual(watcher.wait.call_args_list[0][0][1], 1)
+        self.assertEqual(CHANGES_VIEW_MAP[u''].call_count, 2)
+        self.assertNotIn('stale', CHANGES_VIEW_MAP[u''].call_args[1])
+
+        for timeout in ('nan', 'inf', '-inf', '-5', 'x'):
+            self.request.params['timeout'] = timeout
+            watcher.wait.reset_mock()
+            watcher.wait.side_effect = [False]
+            view.get()
+            self.assertLessEqual(0, watcher.wait.call_args[0][1])
+            self.assertLessEqual(watcher.wait.call_args[0][1], 30)
+
+    def test_14_listing_event_stream(self):
+
+        self.request.params['feed'] = 'changes'
+        self.request.params['stream'] = 'sse'
+        self.request.registry.longpoll_timeout = 30
+        self.request.registry.changes_watcher = watcher = Mock()
+        watcher.wait.return_value = False
+        row = Mock(key=3, id=u'a', value={'dateModified': u'2015-01-01T00:00:00+02:00'})
+        CHANGES_VIEW_MAP[u''].side_effect = [[row], [], []]
+
+        view = DummyResource(self.request, self.context)
+        try:
+            response = view.get()
+            self.assertEqual(response.content_type, 'text/event-stream')
+            events = response.app_iter
+            event = next(events)
+            heartbeat = next(events)
+            next(events)
+        finally:
+            CHANGES_VIEW_MAP[u''].side_effect = None
+
+        event_id, data = event.strip().split('\n')
+        self.assertEqual(Cursor.decode(event_id[4:], view.cursor_secret),
+                         Cursor(3, u'a', u'', u'changes', False))
+        self.assertEqual(json.loads(data[6:]), {'id': 'a', 'dateModified': '2015-01-01T00:00:00+02:00'})
+        self.assertEqual(heartbeat, ':\n\n')
+        self.assertEqual(CHANGES_VIEW_MAP[u''].call_args[1]['startkey_docid'], u'a\x00')
+
+    def test_15_listing_projection(self):
+
+        self.request.params['opt_fields'] = 'title'
+        projection = MagicMock()
+        projection.return_value = [Mock(key=u'2015-01-01T00:00:00+02:00', id=u'a', value={'title': u'Title'})]
+
+        view = DummyResource(self.request, self.context)
+        view.PROJECTIONS = {u'dateModified': {u'': [(frozenset(['title']), projection)]}}
+        response = view.get()
+
+        self.assertEqual(response['data'], [{'id': u'a', 'title': u'Title', 'dateModified': u'2015-01-01T00:00:00+02:00'}])
+        self.assertNotIn('include_docs', projection.call_args[1])
+
 
 def suite():
     tests = unittest.TestSuite()
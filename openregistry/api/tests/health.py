@@ -94,3 +94,30 @@ class HealthTest_any(HealthTestBase):
     def test_health_view(self):
         response = self.app.get('/health', params={'health_threshold_func': 'any'}, status=200)
         self.assertEqual(response.status, '200 OK')
+
+
+class ChangesHealthTest(BaseWebTest):
+
+    stats = {'running': True, 'lag': 0}
+
+    def setUp(self):
+        super(ChangesHealthTest, self).setUp()
+        self._changes_watcher = self.app.app.registry.changes_watcher
+        self.app.app.registry.changes_watcher = Mock(**{'stats.return_value': self.stats})
+
+    def tearDown(self):
+        self.app.app.registry.changes_watcher = self._changes_watcher
+        super(ChangesHealthTest, self).tearDown()
+
+    def test_changes_health_view(self):
+        response = self.app.get('/health/changes', status=200)
+        self.assertEqual(response.json, self.stats)
+
+
+class ChangesHealthTest503(ChangesHealthTest):
+
+    stats = {'running': True, 'lag': 1000}
+
+    def test_changes_health_view(self):
+        response = self.app.get('/health/changes', status=503)
+        self.assertEqual(response.json, self.stats)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from collections import namedtuple
+from functools import partial
+
+from openregistry.api.listing import Cursor, next_docid, iter_view_chunks, plan_view, skip_key
+
+SECRET = 'af41bf2254c843dcb0a0a9703af1cb88/tests'
+
+Row = namedtuple('Row', ['key', 'id'])
+
+
+class DummyView(object):
+    """ Mimics CouchDB view ordering and keyset parameters """
+
+    def __init__(self, rows):
+        self.rows = sorted(rows)
+        self.calls = []
+
+    def __call__(self, limit, startkey=None, startkey_docid=None):
+        self.calls.append((limit, startkey, startkey_docid))
+        rows = [
+            Row(key, docid) for key, docid in self.rows
+            if startkey is None or (key, docid) >= (startkey, startkey_docid or u'')
+        ]
+        return rows[:limit]
+
+
+class CursorTest(unittest.TestCase):
+
+    def test_encode_decode(self):
+        cursor = Cursor(u'2017-08-16T12:30:17.615196+03:00', u'625699bf9d5b4f098772d5cafee283fe', u'test', u'', True)
+        value = cursor.encode(SECRET)
+        self.assertNotIn('=', value)
+        self.assertEqual(Cursor.decode(value, SECRET), cursor)
+
+        cursor = Cursor(42, u'625699bf9d5b4f098772d5cafee283fe', u'', u'changes')
+        self.assertEqual(Cursor.decode(cursor.encode(SECRET), SECRET), cursor)
+
+    def test_decode_invalid(self):
+        value = Cursor(42, u'625699bf9d5b4f098772d5cafee283fe').encode(SECRET)
+        payload, signature = value.split('.')
+        self.assertIsNone(Cursor.decode(value, SECRET + '1'))
+        self.assertIsNone(Cursor.decode(payload, SECRET))
+        self.assertIsNone(Cursor.decode(payload[:-1] + '.' + signature, SECRET))
+        self.assertIsNone(Cursor.decode('2015-01-01T00:00:00+02:00', SECRET))
+        self.assertIsNone(Cursor.decode(u'тест.1', SECRET))
+        payload = 'bm90IGpzb24'
+        self.assertIsNone(Cursor.decode('{}.{}'.format(payload, Cursor.sign(SECRET, payload)), SECRET))
+
+    def test_matches_and_reverse(self):
+        cursor = Cursor(42, u'a', u'test', u'changes')
+        self.assertTrue(cursor.matches(u'test', u'changes', False))
+        self.assertFalse(cursor.matches(u'', u'changes', False))
+        self.assertFalse(cursor.matches(u'test', u'changes', True))
+        self.assertTrue(cursor.reverse().matches(u'test', u'changes', True))
+
+    def test_next_docid(self):
+        docid = u'625699bf9d5b4f098772d5cafee283fe'
+        self.assertEqual(next_docid(docid), docid + u'\x00')
+        self.assertGreater(next_docid(docid), docid)
+        self.assertLess(next_docid(docid), u'625699bf9d5b4f098772d5cafee283ff')
+        self.assertLess(next_docid(docid, True), docid)
+        self.assertGreater(next_docid(docid, True), u'625699bf9d5b4f098772d5cafee283fd')
+        self.assertGreater(next_docid(docid, True), u'625699bf9d5b4f098772d5cafee283fd' + u'f' * 32)
+        self.assertEqual(next_docid(u'a\x00', True), u'a')
+
+    def test_view_params(self):
+        self.assertEqual(Cursor(u'2017-08-16').view_params(), {'startkey': u'2017-08-16'})
+        self.assertEqual(Cursor(u'2017-08-16', u'a').view_params(),
+                         {'startkey': u'2017-08-16', 'startkey_docid': u'a\x00'})
+        self.assertEqual(Cursor(u'2017-08-16', u'b', descending=True).view_params(),
+                         {'startkey': u'2017-08-16', 'startkey_docid': u'a\U0010ffff'})
+
+
+class IterViewChunksTest(unittest.TestCase):
+
+    def test_iter_view_chunks(self):
+        rows = [(u'2017-01-0{}'.format(i % 3), u'{:032x}'.format(i)) for i in range(7)]
+        view = DummyView(rows)
+        chunks = list(iter_view_chunks(view, 3))
+        self.assertEqual([len(i) for i in chunks], [3, 3, 1])
+        self.assertEqual([tuple(i) for chunk in chunks for i in chunk], sorted(rows))
+        self.assertEqual(len(view.calls), 3)
+        self.assertEqual(view.calls[1][2], chunks[0][-1].id + u'\x00')
+
+    def test_iter_view_chunks_exact(self):
+        view = DummyView([(u'2017-01-01', u'a'), (u'2017-01-01', u'b')])
+        chunks = list(iter_view_chunks(view, 2))
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(len(view.calls), 2)
+        self.assertEqual(list(iter_view_chunks(DummyView([]), 2)), [])
+
+    def test_skip_key(self):
+        rows = [(u'2017-01-01', u'a'), (u'2017-01-01', u'b'), (u'2017-01-01', u'c'),
+                (u'2017-01-02', u'a'), (u'2017-01-03', u'a')]
+        view = DummyView(rows)
+        first_page = skip_key(partial(view, startkey=u'2017-01-01'), u'2017-01-01')
+        self.assertEqual(first_page(limit=2), [(u'2017-01-02', u'a'), (u'2017-01-03', u'a')])
+        self.assertEqual(view.calls, [(2, u'2017-01-01', None), (2, u'2017-01-01', u'b\x00'),
+                                      (1, u'2017-01-02', u'a\x00')])
+        self.assertEqual(first_page(limit=10), rows[3:])
+        self.assertEqual(first_page(limit=1, **Cursor(u'2017-01-01', u'a').view_params()), [(u'2017-01-01', u'b')])
+        chunks = list(iter_view_chunks(first_page, 1))
+        self.assertEqual([tuple(i) for chunk in chunks for i in chunk], rows[3:])
+        first_page = skip_key(partial(view, startkey=u'2017-01-02'), u'2017-01-01')
+        self.assertEqual(first_page(limit=1), [(u'2017-01-02', u'a')])
+
+
+class PlanViewTest(unittest.TestCase):
+
+    def test_plan_view(self):
+        projections = [
+            (frozenset(['status', 'title', 'description']), 'wide'),
+            (frozenset(['status', 'title']), 'narrow'),
+        ]
+        self.assertEqual(plan_view(['status'], 'default', ['status', 'assetID'], projections), 'default')
+        self.assertEqual(plan_view(['title'], 'default', ['status', 'assetID'], projections), 'narrow')
+        self.assertEqual(plan_view(['description'], 'default', ['status', 'assetID'], projections), 'wide')
+        self.assertEqual(plan_view(['status'], 'default', ['status', 'assetID', 'assetType'], projections), 'narrow')
+        self.assertIsNone(plan_view(['items'], 'default', ['status'], projections))
+        self.assertIsNone(plan_view(['items'], 'default', ['status'], []))
+
+
+def suite():
+    tests = unittest.TestSuite()
+    tests.addTest(unittest.makeSuite(CursorTest))
+    tests.addTest(unittest.makeSuite(IterViewChunksTest))
+    tests.addTest(unittest.makeSuite(PlanViewTest))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
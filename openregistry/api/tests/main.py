@@ -2,7 +2,7 @@
 
 import unittest
 
-from openregistry.api.tests import auth, spore, migration, models, utils
+from openregistry.api.tests import auth, spore, migration, models, utils, listing, changes, cache, design, transport, replicas, validation, constants, revisions, renderers, codec
 from openregistry.api.tests.dummy_resource import test
 
 
@@ -13,6 +13,17 @@ def suite():
     tests.addTest(migration.suite())
     tests.addTest(models.suite())
     tests.addTest(utils.suite())
+    tests.addTest(listing.suite())
+    tests.addTest(changes.suite())
+    tests.addTest(cache.suite())
+    tests.addTest(design.suite())
+    tests.addTest(transport.suite())
+    tests.addTest(replicas.suite())
+    tests.addTest(validation.suite())
+    tests.addTest(constants.suite())
+    tests.addTest(revisions.suite())
+    tests.addTest(renderers.suite())
+    tests.addTest(codec.suite())
     tests.addTest(test.suite())
     return tests
 
@@ -1,16 +1,18 @@
 # -*- coding: utf-8 -*-
 import unittest
+import iso8601
 import mock
 from copy import deepcopy
 from datetime import datetime, timedelta
-from schematics.exceptions import ConversionError, ValidationError, ModelValidationError
+from schematics.exceptions import ConversionError, ValidationError, ModelValidationError, ModelConversionError
 from decimal import Decimal
 
+from openregistry.api.constants import TZ
 from openregistry.api.utils import get_now
 
 from openregistry.api.models.roles import blacklist
 from openregistry.api.models.schematics_extender import (
-    IsoDateTimeType, HashType)
+    IsoDateTimeType, HashType, Model)
 from openregistry.api.models.ocds import (
     Organization, ContactPoint, Identifier, Address,
     Item, Location, Unit, Value, ItemClassification, Classification,
@@ -48,6 +50,20 @@ class SchematicsExtenderTest(unittest.TestCase):
             with self.assertRaises(ConversionError):
                 dt.to_native(dt.to_primitive(date))
 
+    def test_IsoDateTimeType_api_format(self):
+        dt = IsoDateTimeType()
+        for value in ('2017-01-01T12:00:00.123456+02:00', '2017-07-01T12:00:00+03:00',
+                      '2017-01-01T12:00:00Z', '2017-01-01T12:00:00-05:30', '2017-01-01T12:00:00.12+02:00',
+                      '2017-01-01', '2017-07-01T10:00'):
+            date = iso8601.parse_date(value, None)
+            if not date.tzinfo:
+                date = TZ.localize(date)
+            self.assertEqual(dt.to_native(value), date)
+            self.assertEqual(dt.to_primitive(dt.to_native(value)), date.isoformat())
+        self.assertIs(dt.to_native(now.isoformat()), dt.to_native(now.isoformat()))
+        with self.assertRaisesRegexp(ConversionError, u'Could not parse 2017-13-01T12:00:00\+02:00'):
+            dt.to_native('2017-13-01T12:00:00+02:00')
+
     def test_DecimalType_model(self):
         number = '5.001'
 
@@ -91,6 +107,46 @@ class SchematicsExtenderTest(unittest.TestCase):
         result = 'md5:{}'.format(uuid4().hex)
         self.assertEqual(hash.to_native(result), result)
 
+    def test_model_descriptor(self):
+        from schematics.types import StringType
+        from schematics.types.serializable import serializable
+
+        class Dummy(Model):
+            class Options:
+                roles = {
+                    'view': blacklist('hash'),
+                    'custom': lambda name, value: value is None,
+                }
+            title = StringType(default=u'Dummy')
+            hash = StringType()
+            date = IsoDateTimeType(default=get_now)
+
+            @serializable
+            def url(self):
+                return 'url'
+
+        meta = Dummy._meta
+        self.assertEqual(meta.fields, ('__parent__', 'title', 'hash', 'date'))
+        self.assertEqual(meta.data_fields, ('title', 'hash', 'date'))
+        self.assertEqual(meta.serializables, ('url',))
+        self.assertEqual(meta.default('title'), u'Dummy')
+        self.assertIsNone(meta.default('hash'))
+        self.assertIsInstance(meta.default('date'), datetime)
+        self.assertEqual(meta.hidden['view'], frozenset(['hash']))
+        self.assertEqual(meta.hidden['default'], frozenset(['__parent__']))
+        self.assertNotIn('custom', meta.hidden)
+        self.assertTrue(meta.is_hidden('view', 'hash'))
+        self.assertTrue(meta.is_hidden('unknown', '__parent__'))
+        self.assertFalse(meta.is_hidden('unknown', 'hash'))
+        self.assertTrue(meta.is_hidden('custom', 'hash', None))
+        self.assertFalse(meta.is_hidden('custom', 'hash', []))
+
+        class Child(Dummy):
+            description = StringType()
+
+        self.assertEqual(Child._meta.data_fields, ('title', 'hash', 'date', 'description'))
+        self.assertIsNot(Child._meta, meta)
+
 
 class DummyOCDSModelsTest(unittest.TestCase):
     """ Test Case for testing openregistry.api.models'
@@ -476,10 +532,152 @@ class DummyOCDSModelsTest(unittest.TestCase):
         self.assertEqual(serialized_by_create, data)
 
 
+class ExportTest(unittest.TestCase):
+    """ Compiled exporters give the same output as schematics export_loop """
+
+    def setUp(self):
+        from schematics.types import StringType, IntType
+        from schematics.types.compound import ListType, ModelType, DictType
+        from schematics.types.serializable import serializable
+        from schematics.transforms import whitelist
+
+        class Unit(Model):
+            class Options:
+                roles = {'view': blacklist('code')}
+            name = StringType()
+            code = StringType()
+            value = DecimalType()
+
+        class Entry(Model):
+            class Options:
+                roles = {
+                    'view': blacklist('secret'),
+                    'dynamic': lambda name, value: value is None,
+                }
+            title = StringType(required=True)
+            secret = StringType()
+            date = IsoDateTimeType()
+            quantity = IntType()
+            unit = ModelType(Unit)
+            units = ListType(ModelType(Unit), default=list())
+            tags = ListType(StringType())
+            dates = ListType(IsoDateTimeType())
+            meta = DictType(StringType())
+            children = ListType(ModelType(Unit))
+
+            @serializable
+            def summary(self):
+                return self.title and self.title.upper()
+
+            @serializable(serialized_name='count', type=IntType())
+            def units_count(self):
+                return len(self.units)
+
+        class Listed(Model):
+            class Options:
+                roles = {'listing': whitelist('title')}
+            title = StringType()
+            entries = ListType(ModelType(Entry))
+
+        self.Entry = Entry
+        self.Listed = Listed
+        unit = {'name': u'кг', 'code': 'KGM', 'value': '1.5'}
+        self.data = {
+            'title': u'Назва',
+            'secret': 'secret',
+            'date': now.isoformat(),
+            'quantity': 5,
+            'unit': unit,
+            'units': [unit, {'name': u'шт'}],
+            'tags': ['a', 'b'],
+            'dates': [now.isoformat()],
+            'meta': {'a': 'b'},
+            'children': [{'name': 'child'}, {}],
+        }
+
+    def assertExport(self, instance, role=None):
+        from schematics.transforms import to_primitive
+        self.assertEqual(instance.serialize(role), to_primitive(type(instance), instance, role=role))
+
+    def test_export(self):
+        entry = self.Entry(self.data)
+        for role in (None, 'view', 'dynamic', 'default', 'embedded'):
+            self.assertExport(entry, role)
+        self.assertExport(self.Entry({'title': u'Назва'}))
+        self.assertExport(self.Listed({'title': 'a', 'entries': [self.data]}))
+        self.assertExport(self.Listed({'title': 'a', 'entries': [self.data]}), 'listing')
+        self.assertIsNone(self.Listed().serialize())
+        self.assertIsInstance(entry.serialize()['unit']['value'], Decimal)
+        self.assertEqual(entry.serialize()['date'], now.isoformat())
+
+    def test_unknown_role(self):
+        with self.assertRaisesRegexp(ValueError, 'Entry Model has no role "unknown"'):
+            self.Entry(self.data).serialize('unknown')
+
+
+class LazyResourceTest(unittest.TestCase):
+
+    def setUp(self):
+        from schematics.types import StringType
+        from schematics.types.compound import ListType, ModelType
+        from openregistry.api.models.common import BaseResourceItem
+
+        class Attachment(Model):
+            id = StringType()
+            title = StringType()
+            url = StringType()
+            format = StringType()
+
+        class Resource(BaseResourceItem):
+            status = StringType()
+            documents = ListType(ModelType(Attachment), default=list())
+
+        self.Resource = Resource
+        self.raw = {
+            '_id': 'a' * 32,
+            '_rev': '1-b',
+            'status': 'active',
+            'documents': [{'id': 'c' * 32, 'title': 'name.doc', 'url': 'http://localhost/doc', 'format': 'application/msword'}],
+            'revisions': [{'author': 'broker', 'date': now.isoformat(), 'changes': []}],
+        }
+
+    def test_nested_fields_converted_on_access(self):
+        resource = self.Resource.wrap_lazy(self.raw)
+        self.assertEqual(self.Resource._meta.lazy_fields, frozenset(['documents', 'revisions', 'revisionSegments', '_attachments']))
+        self.assertEqual(resource.status, 'active')
+        self.assertEqual(sorted(resource.__dict__['_raw']), ['documents', 'revisions'])
+        self.assertIs(resource.documents[0].__parent__, resource)
+        self.assertEqual(resource.__dict__['_raw'].keys(), ['revisions'])
+        resource.__parent__ = None
+        self.assertEqual(resource.__dict__['_raw'].keys(), ['revisions'])
+        self.assertEqual(resource.serialize(), self.Resource(self.raw).serialize())
+        self.assertFalse(resource.__dict__['_raw'])
+
+    def test_same_as_eager(self):
+        resource = self.Resource.wrap_lazy(self.raw)
+        self.assertEqual(resource, self.Resource(self.raw))
+        self.assertEqual(resource.doc_type, 'Resource')
+        resource = self.Resource.wrap_lazy(self.raw)
+        resource.validate()
+        self.assertEqual(resource.revisions[0].author, 'broker')
+
+    def test_conversion_errors(self):
+        with self.assertRaises(ModelConversionError) as e:
+            self.Resource.wrap_lazy(dict(self.raw, rogue=1))
+        self.assertEqual(e.exception.messages, {'rogue': 'Rogue field'})
+        resource = self.Resource.wrap_lazy(dict(self.raw, revisions=[{'date': 'now'}]))
+        self.assertEqual(resource.status, 'active')
+        with self.assertRaises(ModelConversionError) as e:
+            resource.revisions
+        self.assertEqual(e.exception.messages, {'revisions': {'date': [u'Could not parse now. Should be ISO8601.']}})
+
+
 def suite():
     tests = unittest.TestSuite()
     tests.addTest(unittest.makeSuite(DummyOCDSModelsTest))
     tests.addTest(unittest.makeSuite(SchematicsExtenderTest))
+    tests.addTest(unittest.makeSuite(ExportTest))
+    tests.addTest(unittest.makeSuite(LazyResourceTest))
     return tests
 
 
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import unittest
+from decimal import Decimal
+import simplejson
+from pyramid import testing
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.renderers import JSON, JSONP
+
+from openregistry.api.renderers import StreamingJSON, StreamingJSONP
+
+
+class Item(object):
+    def __json__(self, request):
+        return {'id': 'item'}
+
+
+VALUES = [
+    {},
+    [],
+    {'data': []},
+    {'data': [{'id': str(i), 'value': {'amount': Decimal('10.01')}, 'title': u'Земля'} for i in range(50)],
+     'next_page': {'offset': '', 'path': '/api'}},
+    {'data': {'items': [1, [2, (3, 4)], {'a': {}}], 'item': Item(), None: 1}},
+    [{'data': None}, 1.5, u'☃', True],
+    'string',
+]
+
+
+class StreamingRendererTest(unittest.TestCase):
+
+    def render(self, factory, value, request):
+        result = factory(None)(value, {'request': request})
+        return result if isinstance(result, basestring) else ''.join(result)
+
+    def test_same_output(self):
+        for kw in ({}, {'indent': 4}):
+            for value in VALUES:
+                request = testing.DummyRequest()
+                expected = JSON(serializer=simplejson.dumps, **kw)(None)(value, {'request': request})
+                for chunk_size in (1, 16, 64 * 1024):
+                    request = testing.DummyRequest()
+                    renderer = StreamingJSON(chunk_size=chunk_size, **kw)
+                    self.assertEqual(self.render(renderer, value, request), expected)
+                    self.assertEqual(request.response.content_type, 'application/json')
+
+    def test_jsonp(self):
+        value = VALUES[3]
+        request = testing.DummyRequest(params={'opt_jsonp': 'callback'})
+        expected = JSONP(param_name='opt_jsonp', serializer=simplejson.dumps)(None)(value, {'request': request})
+        request = testing.DummyRequest(params={'opt_jsonp': 'callback'})
+        renderer = StreamingJSONP(param_name='opt_jsonp', chunk_size=100)
+        self.assertEqual(self.render(renderer, value, request), expected)
+        self.assertEqual(request.response.content_type, 'application/javascript')
+
+        request = testing.DummyRequest()
+        self.assertEqual(self.render(renderer, value, request), simplejson.dumps(value))
+        self.assertEqual(request.response.content_type, 'application/json')
+
+        request = testing.DummyRequest(params={'opt_jsonp': 'alert(1)'})
+        with self.assertRaises(HTTPBadRequest):
+            renderer(None)(value, {'request': request})
+
+    def test_chunks(self):
+        value = {'data': [{'id': str(i), 'title': u'Земля'} for i in range(1000)]}
+        request = testing.DummyRequest()
+        result = StreamingJSON(chunk_size=1024)(None)(value, {'request': request})
+        self.assertNotIsInstance(result, basestring)
+        chunks = list(result)
+        self.assertEqual(len(chunks), 11)
+        self.assertTrue(all([isinstance(i, str) for i in chunks]))
+        self.assertEqual(''.join(chunks), simplejson.dumps(value))
+        result = StreamingJSON()(None)(VALUES[3], {'request': request})
+        self.assertIsInstance(result, str)
+
+        # errors in the first chunks are raised before the response starts
+        value = {'data': [{'id': str(i)} for i in range(100)] + [object()]}
+        with self.assertRaises(TypeError):
+            StreamingJSON(chunk_size=1024)(None)(value, {'request': request})
+
+
+def suite():
+    tests = unittest.TestSuite()
+    tests.addTest(unittest.makeSuite(StreamingRendererTest))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
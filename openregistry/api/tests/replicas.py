@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from mock import MagicMock
+from pyramid import testing
+
+from openregistry.api.replicas import replication_lag, ReplicaRouter, read_db
+
+
+def replica(name, tasks):
+    server = MagicMock()
+    if isinstance(tasks, Exception):
+        server.tasks.side_effect = tasks
+    else:
+        server.tasks.return_value = tasks
+    db = MagicMock()
+    db.name = 'openregistry'
+    db.resource.url = 'http://{}:5984/openregistry'.format(name)
+    return server, db
+
+
+def task(target, source_seq, checkpointed_source_seq):
+    return {
+        'type': 'replication',
+        'target': target,
+        'source_seq': source_seq,
+        'checkpointed_source_seq': checkpointed_source_seq,
+    }
+
+
+class ReplicationLagTest(unittest.TestCase):
+
+    def test_replication_lag(self):
+        tasks = [
+            task('openregistry/', 100, 90),
+            task('http://localhost:5984/openregistry', 100, 40),
+            task('other', 100, 0),
+            {'type': 'indexer'},
+        ]
+        self.assertEqual(replication_lag(tasks, 'openregistry'), 60)
+        self.assertIsNone(replication_lag(tasks, 'missing'))
+        self.assertIsNone(replication_lag([], 'openregistry'))
+
+
+class ReplicaRouterTest(unittest.TestCase):
+
+    def test_check_and_choose(self):
+        first = replica('first', [task('openregistry', 10, 5)])
+        second = replica('second', [task('openregistry', 1000, 5)])
+        third = replica('third', Exception('Connection refused'))
+        router = ReplicaRouter([first, second, third], 512)
+        self.assertIsNone(router.choose())
+
+        router.check()
+        self.assertEqual(router.healthy, [first[1]])
+        self.assertIs(router.choose(), first[1])
+        self.assertEqual(router.stats(), {
+            'http://first:5984/openregistry': {'lag': 5, 'healthy': True},
+            'http://second:5984/openregistry': {'lag': 995, 'healthy': False},
+            'http://third:5984/openregistry': {'lag': None, 'healthy': False},
+        })
+
+        second[0].tasks.return_value = [task('openregistry', 1000, 990)]
+        router.check()
+        self.assertEqual(set([router.choose(), router.choose()]), set([first[1], second[1]]))
+
+    def test_read_db(self):
+        request = testing.DummyRequest()
+        request.registry.db = MagicMock()
+        self.assertIs(read_db(request), request.registry.db)
+
+        router = request.registry.replica_router = ReplicaRouter([replica('first', [task('openregistry', 1, 1)])], 512)
+        self.assertIs(read_db(request), request.registry.db)
+        router.check()
+        self.assertIs(read_db(request), router.healthy[0])
+        request.method = 'PATCH'
+        self.assertIs(read_db(request), request.registry.db)
+
+
+def suite():
+    tests = unittest.TestSuite()
+    tests.addTest(unittest.makeSuite(ReplicationLagTest))
+    tests.addTest(unittest.makeSuite(ReplicaRouterTest))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
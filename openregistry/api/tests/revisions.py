@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import unittest
+from datetime import timedelta
+from couchdb.http import ResourceConflict, ServerError
+from mock import Mock
+from schematics.types import StringType
+
+from openregistry.api.models.common import BaseResourceItem, Revision
+from openregistry.api.models.roles import plain_role
+from openregistry.api.revisions import (
+    RevisionStore, count_revisions, get_revisions, get_state, segment_id, snapshot_id
+)
+from openregistry.api.utils import get_now, get_revision_changes
+
+START = get_now()
+
+
+class Resource(BaseResourceItem):
+    class Options:
+        roles = {'plain': plain_role}
+
+    status = StringType()
+
+
+class RevisionStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.docs = {}
+        self.db = Mock()
+        self.db.update.side_effect = self.update
+        self.db.save.side_effect = lambda doc: self.update([doc])
+        self.item = Resource({'_id': 'a' * 32, '_rev': '0-a', 'status': 'status0'})
+        # every revision changes the status and keeps changes back to the previous one
+        for i in range(1, 26):
+            self.change('status{}'.format(i), '{}-a'.format(i))
+
+    def update(self, docs):
+        results = []
+        for doc in docs:
+            if doc['_id'] in self.docs:
+                results.append((False, doc['_id'], ResourceConflict()))
+            else:
+                self.docs[doc['_id']] = doc
+                results.append((True, doc['_id'], '1-a'))
+        return results
+
+    def change(self, status, rev):
+        src = self.item.serialize('plain')
+        self.item.status = status
+        self.item.revisions.append(Revision({
+            'author': 'broker',
+            'changes': get_revision_changes(self.item.serialize('plain'), src),
+            'rev': self.item.rev,
+            'date': START + timedelta(hours=int(rev.split('-')[0])),
+        }))
+        self.item._rev = rev
+
+    def test_offload(self):
+        store = RevisionStore(self.db, window=5, segment_size=10)
+        self.assertEqual(store.offload(self.item), 20)
+        self.assertEqual(self.item.revisionSegments, [10, 10])
+        self.assertEqual(len(self.item.revisions), 5)
+        self.assertEqual(sorted(self.docs), [segment_id(self.item.id, 0), segment_id(self.item.id, 10)])
+        self.assertEqual(self.docs[segment_id(self.item.id, 10)]['revisions'][0]['rev'], '10-a')
+        self.assertEqual(count_revisions(self.item), 25)
+        self.assertEqual(store.offload(self.item), 0)
+        self.assertNotIn('revisionSegments', self.item.serialize('plain'))
+
+        for i in range(26, 36):
+            self.change('status{}'.format(i), '{}-a'.format(i))
+        self.assertEqual(store.offload(self.item), 10)
+        self.assertEqual(self.item.revisionSegments, [10, 10, 10])
+        self.assertEqual(len(self.item.revisions), 5)
+
+    def test_offload_retry(self):
+        store = RevisionStore(self.db, window=5, segment_size=10)
+        data = self.item.serialize()
+        store.offload(Resource(data))
+        self.assertEqual(store.offload(self.item), 20)
+        self.db.update.side_effect = lambda docs: [(False, i['_id'], ServerError()) for i in docs]
+        with self.assertRaises(ServerError):
+            store.offload(Resource(data))
+
+    def test_get_revisions(self):
+        revisions = [i.to_primitive() for i in self.item.revisions]
+        RevisionStore(self.db, window=5, segment_size=10).offload(self.item)
+        load = Mock(side_effect=self.docs.get)
+        self.assertEqual(get_revisions(self.item, load, 0, 100), revisions)
+        self.assertEqual(get_revisions(self.item, load, 8, 4), revisions[8:12])
+        self.assertEqual(load.call_count, 4)
+        self.assertEqual(get_revisions(self.item, load, 18, 10), revisions[18:28])
+        self.assertEqual(get_revisions(self.item, load, 30, 10), [])
+
+    def test_get_state(self):
+        RevisionStore(self.db, window=5, segment_size=10).offload(self.item)
+        load = self.docs.get
+        self.assertEqual(get_state(self.item, load, '25-a')['status'], 'status25')
+        self.assertEqual(get_state(self.item, load, '22-a')['status'], 'status22')
+        self.assertEqual(get_state(self.item, load, '3-a')['status'], 'status3')
+        self.assertEqual(get_state(self.item, load, '0-a')['status'], 'status0')
+        self.assertIsNone(get_state(self.item, load, '99-a'))
+
+
+    def test_get_state_by_date(self):
+        RevisionStore(self.db, window=5, segment_size=10).offload(self.item)
+        load = self.docs.get
+        self.assertEqual(get_state(self.item, load, date=START + timedelta(hours=3))['status'], 'status3')
+        self.assertEqual(get_state(self.item, load, date=START + timedelta(hours=3, minutes=59))['status'], 'status3')
+        self.assertEqual(get_state(self.item, load, date=START + timedelta(hours=30))['status'], 'status25')
+        self.assertIsNone(get_state(self.item, load, date=START))
+
+    def test_snapshots(self):
+        store = RevisionStore(self.db, window=5, segment_size=10, snapshot_interval=10)
+        self.item = Resource({'_id': 'b' * 32, '_rev': '0-a', 'status': 'status0'})
+        for i in range(1, 26):
+            self.change('status{}'.format(i), '{}-a'.format(i))
+            store.offload(self.item)
+            self.assertEqual(store.checkpoint(self.item), i % 10 == 0)
+        self.assertEqual(sorted([i for i in self.docs if 'snapshot' in i]),
+                         [snapshot_id(self.item.id, 10), snapshot_id(self.item.id, 20)])
+        self.assertEqual(self.docs[snapshot_id(self.item.id, 10)]['data']['status'], 'status10')
+
+        load = Mock(side_effect=self.docs.get)
+        self.assertEqual(get_state(self.item, load, '3-a', snapshot_interval=10)['status'], 'status3')
+        loaded = [i[0][0] for i in load.call_args_list]
+        self.assertIn(snapshot_id(self.item.id, 10), loaded)
+        self.assertEqual(get_state(self.item, load, '10-a', snapshot_interval=10)['status'], 'status10')
+        self.assertEqual(get_state(self.item, load, '22-a', snapshot_interval=10)['status'], 'status22')
+
+        # snapshots not matching the history are not used
+        self.docs[snapshot_id(self.item.id, 10)]['rev'] = '9-a'
+        self.assertEqual(get_state(self.item, load, '3-a', snapshot_interval=10)['status'], 'status3')
+        self.assertEqual(get_state(self.item, load, '3-a', snapshot_interval=7)['status'], 'status3')
+
+
+def suite():
+    tests = unittest.TestSuite()
+    tests.addTest(unittest.makeSuite(RevisionStoreTest))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from couchdb import http
+from mock import MagicMock, patch
+
+from openregistry.api.transport import RetryDelays, ConnectionPool, Session, couchdb_session
+
+URL = 'http://localhost:5984/db/doc'
+
+
+class RetryDelaysTest(unittest.TestCase):
+
+    def test_delays(self):
+        delays = RetryDelays(5, 0.1, 0.3)
+        self.assertEqual(len(delays), 5)
+        values = list(delays)
+        self.assertEqual(len(values), 5)
+        self.assertEqual(values[0], 0)
+        for value, cap in zip(values[1:], [0.1, 0.2, 0.3, 0.3]):
+            self.assertGreaterEqual(value, cap / 2)
+            self.assertLessEqual(value, cap)
+        self.assertEqual(list(RetryDelays(0)), [])
+
+
+@patch('couchdb.http.ConnectionPool.get', side_effect=lambda url: MagicMock())
+class ConnectionPoolTest(unittest.TestCase):
+
+    def test_reuse(self, get):
+        pool = ConnectionPool(None, max_size=1)
+        conn = pool.get(URL)
+        pool.release(URL, conn)
+        self.assertIs(pool.get(URL), conn)
+        self.assertIsNot(pool.get(URL), conn)
+        self.assertEqual(pool.created, 2)
+
+        other = pool.get(URL)
+        pool.release(URL, conn)
+        pool.release(URL, other)
+        other.close.assert_called_once_with()
+        self.assertEqual(pool.stats()['idle'], 1)
+
+    @patch('openregistry.api.transport.time')
+    def test_keepalive(self, time, get):
+        time.return_value = 100
+        pool = ConnectionPool(None, keepalive=30)
+        conn = pool.get(URL)
+        pool.release(URL, conn)
+        time.return_value = 131
+        self.assertIsNot(pool.get(URL), conn)
+        conn.close.assert_called_once_with()
+        self.assertEqual(pool.stats(), {'idle': 0, 'created': 2, 'expired': 1})
+
+
+class SessionTest(unittest.TestCase):
+
+    def test_couchdb_session(self):
+        session = couchdb_session({'couchdb.timeout': '5', 'couchdb.pool_size': '3', 'couchdb.retries': '2'})
+        self.assertEqual(session.connection_pool.timeout, 5)
+        self.assertEqual(session.connection_pool.max_size, 3)
+        self.assertEqual(len(session.retry_delays), 2)
+        self.assertIsNone(couchdb_session({}).connection_pool.timeout)
+
+    @patch('openregistry.api.transport.get_current_request')
+    @patch('couchdb.http.Session.request')
+    def test_timing(self, request, get_current_request):
+        pyramid_request = get_current_request.return_value = MagicMock(spec=[])
+        request.return_value = (200, {}, None)
+        session = Session()
+        session.request('GET', URL)
+        request.side_effect = http.ResourceNotFound(('not_found', 'missing'))
+        with self.assertRaises(http.ResourceNotFound):
+            session.request('GET', URL)
+        calls, duration = pyramid_request.couchdb_timing
+        self.assertEqual(calls, 2)
+        self.assertGreaterEqual(duration, 0)
+
+        request.side_effect = None
+        get_current_request.return_value = None
+        session.request('GET', URL)
+
+
+def suite():
+    tests = unittest.TestSuite()
+    tests.addTest(unittest.makeSuite(RetryDelaysTest))
+    tests.addTest(unittest.makeSuite(ConnectionPoolTest))
+    tests.addTest(unittest.makeSuite(SessionTest))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -1,30 +1,42 @@
 # -*- coding: utf-8 -*-
 import mock
 import os
+import sys
 import unittest
 
 from cornice.errors import Errors
 from couchdb.client import Document
+from copy import deepcopy
 from datetime import datetime
+from jsonpatch import apply_patch, make_patch
 from libnacl.sign import Signer
 from pyramid.config import Configurator
+from pyramid.httpexceptions import HTTPNotModified
+from pyramid.request import Request
 from pytz import timezone
-from uuid import UUID
+from timeit import timeit
+from uuid import UUID, uuid4
 
+from openregistry.api.traversal import get_document
 from openregistry.api.utils import (
     apply_data_patch,
+    check_conditional_request,
     context_unpack,
     error_handler,
     decrypt, encrypt,
+    diff_data,
     forbidden,
     generate_docservice_url,
     generate_id,
     get_content_configurator,
+    get_etag,
     get_now,
     get_revision_changes,
+    json_body_lookup,
     load_plugins,
     prepare_patch,
     raise_operation_error,
+    request_etag,
     set_modetest_titles,
     set_ownership,
     set_parent,
@@ -148,6 +160,68 @@ class UtilsTest(unittest.TestCase):
         expected_result = expected_result.sort(key=lambda r: r['path'])
         self.assertEqual(result, expected_result)
 
+    def test_diff_data(self):
+        src = {
+            'status': 'active',
+            'items': [{'id': str(i), 'quantity': i} for i in range(5)],
+            'documents': [{'id': 'a', 'title': 'a.doc'}],
+            'revisions': [{'author': 'broker', 'changes': []}],
+        }
+        dst = deepcopy(src)
+        dst['status'] = 'pending'
+        del dst['items'][1]
+        dst['items'][2]['quantity'] = 10
+        dst['items'].insert(3, {'id': 'new'})
+        dst['documents'].append({'id': 'a', 'title': 'b.doc'})
+        dst['revisions'].append({'author': 'broker', 'changes': []})
+        dst['a/b~c'] = 1
+        changes = []
+        diff_data(changes, src, dst)
+        self.assertEqual(sorted(changes), sorted([
+            {'op': 'replace', 'path': '/status', 'value': 'pending'},
+            {'op': 'remove', 'path': '/items/1'},
+            {'op': 'replace', 'path': '/items/2/quantity', 'value': 10},
+            {'op': 'add', 'path': '/items/3', 'value': {'id': 'new'}},
+            {'op': 'add', 'path': '/documents/1', 'value': {'id': 'a', 'title': 'b.doc'}},
+            {'op': 'add', 'path': '/revisions/1', 'value': {'author': 'broker', 'changes': []}},
+            {'op': 'add', 'path': '/a~1b~0c', 'value': 1},
+        ]))
+        self.assertEqual(apply_patch(src, changes), dst)
+        self.assertEqual(apply_patch(dst, get_revision_changes(dst, src)), src)
+
+        # reordered objects and lists of values are compared by position
+        dst = deepcopy(src)
+        dst['items'].reverse()
+        dst['tags'] = [1, 2]
+        changes = []
+        diff_data(changes, src, dst)
+        self.assertEqual(len(changes), 9)
+        self.assertEqual(apply_patch(src, changes), dst)
+        changes = []
+        diff_data(changes, dst, src)
+        self.assertEqual(apply_patch(dst, changes), src)
+        changes = []
+        diff_data(changes, src, deepcopy(src))
+        self.assertEqual(changes, [])
+
+        # ids of any type may come from request bodies
+        for items in ([{'id': [1]}], [{'id': {'a': 1}}, {'id': 'a'}], [{'id': 1.5}, {'id': None}]):
+            dst = dict(src, items=items)
+            changes = []
+            diff_data(changes, src, dst)
+            self.assertEqual(apply_patch(src, changes), dst)
+            changes = []
+            diff_data(changes, dst, src)
+            self.assertEqual(apply_patch(dst, changes), src)
+
+        # revisions trimmed from the head
+        revisions = [{'rev': str(i), 'changes': []} for i in range(4)]
+        src = {'revisions': revisions[:3]}
+        dst = {'revisions': revisions[2:]}
+        changes = []
+        diff_data(changes, src, dst)
+        self.assertEqual(apply_patch(src, changes), dst)
+
     def test_apply_data_patch(self):
         item = Document({
             u'status': u'draft',
@@ -350,6 +424,149 @@ class UtilsTest(unittest.TestCase):
         prepare_patch(changes, orig, patch)
         self.assertEqual(changes, [{'path': '/status', 'value': 'pending', 'op': 'add'}])
 
+    def test_get_etag(self):
+        etag = get_etag('1-a', '/api/0.1/assets/a')
+        self.assertEqual(len(etag), 40)
+        self.assertEqual(etag, get_etag(u'1-a', u'/api/0.1/assets/a'))
+        self.assertNotEqual(etag, get_etag('2-b', '/api/0.1/assets/a'))
+        self.assertNotEqual(etag, get_etag('1-a', '/api/0.1/assets/a/documents'))
+        self.assertNotEqual(etag, get_etag('1-a', '/api/0.1/assets/a', 'opt_pretty=1'))
+        self.assertNotEqual(etag, get_etag('1-a', '/api/0.1/assets/a', '', ['g:brokers']))
+
+    def test_check_conditional_request(self):
+        request = Request.blank('/api/0.1/assets/a')
+        check_conditional_request(request, '1-a')
+        self.assertEqual(request.response_etag, request_etag(request, '1-a'))
+
+        request = Request.blank('/api/0.1/assets/a', headers={'If-None-Match': '"{}"'.format(request.response_etag)})
+        with self.assertRaises(HTTPNotModified):
+            check_conditional_request(request, '1-a')
+        check_conditional_request(request, '2-b')
+
+    def test_check_conditional_request_if_match(self):
+        request = Request.blank('/api/0.1/assets/a', method='PATCH')
+        check_conditional_request(request, '1-a')
+
+        etag = get_etag('1-a', '/api/0.1/assets/a')
+        request = Request.blank('/api/0.1/assets/a?acc_token=1', method='PATCH', headers={'If-Match': '"{}"'.format(etag)})
+        check_conditional_request(request, '1-a')
+
+        class PreconditionFailed(Exception):
+            """ Test exception for error_handler mocking"""
+
+        request.errors = Errors()
+        with mock.patch('openregistry.api.utils.error_handler', return_value=PreconditionFailed):
+            with self.assertRaises(PreconditionFailed):
+                check_conditional_request(request, '2-b')
+        self.assertEqual(request.errors.status, 412)
+
+        # ETag of a GET with options
+        request = Request.blank('/api/0.1/assets/a?opt_pretty=1')
+        check_conditional_request(request, '1-a')
+        request = Request.blank('/api/0.1/assets/a?acc_token=1', method='PATCH',
+                                headers={'If-Match': '"{}"'.format(request.response_etag)})
+        check_conditional_request(request, '1-a')
+
+        # ETag of a GET by another user
+        request = Request.blank('/api/0.1/assets/a')
+        with mock.patch.object(Request, 'effective_principals', ['system.Everyone', 'g:brokers']):
+            check_conditional_request(request, '1-a')
+        request = Request.blank('/api/0.1/assets/a', method='PATCH',
+                                headers={'If-Match': '"{}"'.format(request.response_etag)})
+        check_conditional_request(request, '1-a')
+        request.errors = Errors()
+        with mock.patch('openregistry.api.utils.error_handler', return_value=PreconditionFailed):
+            with self.assertRaises(PreconditionFailed):
+                check_conditional_request(request, '2-b')
+
+    def test_request_etag(self):
+        etags = set()
+        for url in ('/api/0.1/assets/a', '/api/0.1/assets/a?opt_pretty=1', '/api/0.1/assets/a?opt_jsonp=cb',
+                    '/api/0.1/assets/a?opt_jsonp=other'):
+            etags.add(request_etag(Request.blank(url), '1-a'))
+        with mock.patch.object(Request, 'effective_principals', ['system.Everyone', 'g:brokers']):
+            etags.add(request_etag(Request.blank('/api/0.1/assets/a'), '1-a'))
+        self.assertEqual(len(etags), 5)
+        self.assertEqual(set([i.split('.')[0] for i in etags]), set([get_etag('1-a', '/api/0.1/assets/a')]))
+        self.assertEqual(request_etag(Request.blank('/api/0.1/assets/a?acc_token=1&opt_pretty=1'), '1-a'),
+                         request_etag(Request.blank('/api/0.1/assets/a?opt_pretty=1'), '1-a'))
+
+    def test_get_document_conditional(self):
+        request = Request.blank('/api/0.1/assets/a', headers={'If-None-Match': '"{}"'.format(
+            get_etag('1-a', '/api/0.1/assets/a'))})
+        request.registry = mock.Mock(spec=['db', 'queryUtility'])
+        request.registry.queryUtility.return_value = None
+        request.read_db = request.registry.db
+        request.registry.db.get.side_effect = lambda doc_id: {'_id': doc_id, '_rev': '1-a'}
+        request.matchdict = {'asset_id': 'a'}
+        with self.assertRaises(HTTPNotModified):
+            get_document(request, 'a')
+        self.assertEqual(get_document(request, 'a-revisions-0')['_id'], 'a-revisions-0')
+        self.assertEqual(get_document(request, 'a', conditional=False)['_id'], 'a')
+        request.matchdict = None
+        self.assertEqual(get_document(request, 'a')['_id'], 'a')
+
+    def test_json_body_lookup(self):
+        body = '{"data": {}, "options": {"pretty": true}}'
+        request = mock.Mock(content_type='application/json', body=body, json_body={'options': {'pretty': True}})
+        self.assertEqual(json_body_lookup(request, 'options'), {'options': {'pretty': True}})
+
+        request = mock.Mock(content_type='application/json', body=body)
+        type(request).json_body = json = mock.PropertyMock(return_value={})
+        self.assertIsNone(json_body_lookup(request, 'access'))
+        self.assertFalse(json.called)
+        request.content_type = 'multipart/form-data'
+        self.assertIsNone(json_body_lookup(request, 'options'))
+        self.assertFalse(json.called)
+
+        request = Request.blank('/', method='POST', body='{"options": ', content_type='application/json')
+        self.assertIsNone(json_body_lookup(request, 'options'))
+        request = Request.blank('/', method='POST', body='["options"]', content_type='application/json')
+        self.assertIsNone(json_body_lookup(request, 'options'))
+
+def large_asset(items=1000):
+    """ Asset with ``items`` items, a few documents and revisions """
+    return {
+        'id': uuid4().hex,
+        'title': u'Земельна ділянка',
+        'items': [
+            {'id': '{:032x}'.format(i), 'description': u'Об\'єкт {}'.format(i), 'quantity': i,
+             'classification': {'scheme': u'CAV', 'id': u'39513200-3'}, 'address': {'countryName': u'Україна'}}
+            for i in range(items)
+        ],
+        'documents': [{'id': '{:032x}'.format(i), 'title': u'document{}.pdf'.format(i)} for i in range(10)],
+        'revisions': [{'author': u'broker', 'changes': [{'op': 'replace', 'path': '/title', 'value': unicode(i)}]}
+                      for i in range(20)],
+    }
+
+
+def benchmark(number=20):
+    """
+    Prints the time and the number of operations of ``diff_data`` and
+    ``jsonpatch.make_patch`` for a large asset with one item removed,
+    one item changed and a document and a revision appended
+    """
+    src = large_asset()
+    dst = deepcopy(src)
+    del dst['items'][100]
+    dst['items'][500]['quantity'] = 0
+    dst['documents'].append({'id': uuid4().hex, 'title': u'new.pdf'})
+    dst['revisions'].append({'author': u'broker', 'changes': []})
+
+    def run_diff_data():
+        changes = []
+        diff_data(changes, src, dst)
+        return changes
+
+    def run_make_patch():
+        return list(make_patch(src, dst))
+
+    for name, diff in [('make_patch', run_make_patch), ('diff_data', run_diff_data)]:
+        changes = diff()
+        assert apply_patch(src, changes) == dst
+        seconds = timeit(diff, number=number) / number
+        print '{:12} {:.1f} ms {} operations'.format(name, seconds * 1000, len(changes))
+
 
 def suite():
     suite = unittest.TestSuite()
@@ -357,4 +574,7 @@ def suite():
     return suite
 
 if __name__ == '__main__':
-    unittest.main(defaultTest='suite')
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        unittest.main(defaultTest='suite')
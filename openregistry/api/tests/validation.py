@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from cornice.errors import Errors
+from mock import Mock, patch
+from schematics.exceptions import ValidationError
+from schematics.types import StringType, IntType
+from schematics.types.compound import ModelType
+
+from openregistry.api.models.schematics_extender import Model, ListType
+from openregistry.api.validation import validate_data, serialize_fields, patch_model
+
+
+class Item(Model):
+    id = StringType(required=True)
+    quantity = IntType(min_value=0)
+
+    def validate_quantity(self, data, value):
+        if data['id'] == 'locked' and value:
+            raise ValidationError(u'Item is locked')
+
+
+class Asset(Model):
+    class Options:
+        roles = {
+            'edit': Model.Options.roles['default'],
+        }
+
+    title = StringType(required=True)
+    status = StringType(choices=['draft', 'active'], default='draft')
+    items = ListType(ModelType(Item), default=list())
+    limit = IntType()
+
+    def validate_limit(self, data, value):
+        if value is not None and value < len(data['items'] or []):
+            raise ValidationError(u'Limit is less than number of items')
+
+    def get_role(self):
+        return 'edit'
+
+
+class SubAsset(Asset):
+    pass
+
+
+def make_request(context, data):
+    request = Mock()
+    request.errors = Errors()
+    request.validated = {}
+    request.context = context
+    request.json_body = {'data': data}
+    return request
+
+
+class PatchModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.asset = Asset({'title': u'Asset', 'items': [{'id': 'a', 'quantity': 1}], 'limit': 2})
+        self.asset.__parent__ = Mock()
+
+    def test_serialize_fields(self):
+        self.assertEqual(serialize_fields(self.asset, ['title', 'items', 'unknown']),
+                         {'title': u'Asset', 'items': [{'id': 'a', 'quantity': 1}]})
+        self.assertEqual(serialize_fields(self.asset, []), {})
+
+    def test_patch_model(self):
+        items = self.asset.items
+        m = patch_model(self.asset, {'title': u'New', 'status': 'active'})
+        self.assertEqual((m.title, m.status), (u'New', 'active'))
+        self.assertIs(m.items, items)
+        self.assertIs(m.__parent__, self.asset.__parent__)
+        self.assertEqual((self.asset.title, self.asset.status), (u'Asset', 'draft'))
+
+        m = patch_model(self.asset, {'items': [{}, {'id': 'b'}]})
+        self.assertEqual([(i.id, i.quantity) for i in m.items], [('a', 1), ('b', None)])
+        self.assertEqual(len(self.asset.items), 1)
+
+    def test_patch_model_validation(self):
+        with patch('openregistry.api.tests.validation.Item.validate_quantity') as validator:
+            patch_model(self.asset, {'title': u'New'})
+            self.assertFalse(validator.called)
+        with self.assertRaises(Exception) as e:
+            patch_model(self.asset, {'items': [{}, {'id': 'b'}, {'id': 'c'}]})
+        self.assertIn('limit', e.exception.messages)
+        with self.assertRaises(Exception) as e:
+            patch_model(self.asset, {'status': 'deleted'})
+        self.assertIn('status', e.exception.messages)
+
+    def test_validate_data(self):
+        request = make_request(self.asset, {'title': u'New', 'items': [{'quantity': 3}]})
+        data = validate_data(request, Asset, True)
+        self.assertEqual(data, {
+            'title': u'New', 'status': 'draft', 'limit': 2, 'items': [{'id': 'a', 'quantity': 3}]
+        })
+        self.assertEqual(request.validated['data'], data)
+
+        # context of a subclass goes through full serialization and validation
+        legacy = SubAsset(self.asset.serialize())
+        legacy.__parent__ = self.asset.__parent__
+        self.assertEqual(validate_data(make_request(legacy, request.json_body['data']), Asset, True), data)
+
+        request = make_request(self.asset, {'items': [{'id': 'locked', 'quantity': 3}]})
+        with patch('openregistry.api.validation.error_handler', return_value=ValueError):
+            with self.assertRaises(ValueError):
+                validate_data(request, Asset, True)
+        self.assertEqual(request.errors.status, 422)
+        self.assertEqual(request.errors[0]['name'], 'items')
+
+
+def suite():
+    tests = unittest.TestSuite()
+    tests.addTest(unittest.makeSuite(PatchModelTest))
+    return tests
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+from logging import getLogger
+from random import random
+from time import time
+from couchdb import http, util
+from pyramid.threadlocal import get_current_request
+
+LOGGER = getLogger(__name__)
+
+
+class RetryDelays(object):
+    """
+    Delays between retries of a failed CouchDB request: the first retry is
+    immediate (usually a keep-alive connection closed by the server), the next
+    ones back off exponentially with jitter so that workers do not reconnect
+    in lockstep. Every iteration draws new random delays.
+    """
+
+    def __init__(self, retries=10, backoff=0.1, max_backoff=5):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def __len__(self):
+        return self.retries
+
+    def __iter__(self):
+        for i in range(self.retries):
+            if i == 0:
+                yield 0
+            else:
+                yield min(self.backoff * 2 ** (i - 1), self.max_backoff) * (0.5 + random() / 2)
+
+
+class ConnectionPool(http.ConnectionPool):
+    """
+    Keep-alive connection pool that keeps at most ``max_size`` idle
+    connections per host and drops connections idle for longer than
+    ``keepalive`` seconds instead of failing a request on them.
+    """
+
+    def __init__(self, timeout, max_size=10, keepalive=30, disable_ssl_verification=False):
+        super(ConnectionPool, self).__init__(timeout, disable_ssl_verification)
+        self.max_size = max_size
+        self.keepalive = keepalive
+        self.idle = {}
+        self.created = 0
+        self.expired = 0
+
+    def get(self, url):
+        key = util.urlsplit(url, 'http', False)[:2]
+        now = time()
+        conn = None
+        expired = []
+        self.lock.acquire()
+        try:
+            idle = self.idle.setdefault(key, [])
+            while idle:
+                conn, released = idle.pop()
+                if not self.keepalive or now - released < self.keepalive:
+                    break
+                expired.append(conn)
+                conn = None
+        finally:
+            self.lock.release()
+        for i in expired:
+            i.close()
+        self.expired += len(expired)
+        if conn is None:
+            # parent pool has no connections stored and always creates one
+            conn = super(ConnectionPool, self).get(url)
+            self.created += 1
+        return conn
+
+    def release(self, url, conn):
+        key = util.urlsplit(url, 'http', False)[:2]
+        self.lock.acquire()
+        try:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_size:
+                idle.append((conn, time()))
+                conn = None
+        finally:
+            self.lock.release()
+        if conn is not None:
+            conn.close()
+
+    def stats(self):
+        return {
+            'idle': sum([len(i) for i in self.idle.values()]),
+            'created': self.created,
+            'expired': self.expired,
+        }
+
+    def __del__(self):
+        for conns in list(self.idle.values()):
+            for conn, _ in conns:
+                conn.close()
+
+
+class Session(http.Session):
+    """
+    CouchDB session with a bounded keep-alive pool and jittered retries that
+    accounts time spent in CouchDB to the current request.
+    """
+
+    def __init__(self, timeout=None, pool_size=10, keepalive=30, retries=10, backoff=0.1, max_backoff=5):
+        super(Session, self).__init__(timeout=timeout)
+        self.connection_pool = ConnectionPool(timeout, pool_size, keepalive)
+        self.retry_delays = RetryDelays(retries, backoff, max_backoff)
+
+    def request(self, method, url, body=None, headers=None, credentials=None, num_redirects=0):
+        if num_redirects:
+            return super(Session, self).request(method, url, body, headers, credentials, num_redirects)
+        start = time()
+        status = None
+        try:
+            status, _, _ = response = super(Session, self).request(method, url, body, headers, credentials)
+            return response
+        except Exception as e:
+            status = e.__class__.__name__
+            raise
+        finally:
+            duration = time() - start
+            record_couchdb_call(get_current_request(), duration)
+            LOGGER.debug('CouchDB {} {} {} {:.4f}s'.format(method, util.urlsplit(url)[2], status, duration),
+                         extra={'MESSAGE_ID': 'couchdb_request'})
+
+
+def record_couchdb_call(request, duration):
+    if request is None:
+        return
+    calls, total = getattr(request, 'couchdb_timing', (0, 0))
+    request.couchdb_timing = (calls + 1, total + duration)
+
+
+def couchdb_session(settings):
+    """ CouchDB session configured by ``couchdb.*`` settings """
+    timeout = settings.get('couchdb.timeout')
+    return Session(
+        timeout=float(timeout) if timeout else None,
+        pool_size=int(settings.get('couchdb.pool_size', 10)),
+        keepalive=float(settings.get('couchdb.keepalive', 30)),
+        retries=int(settings.get('couchdb.retries', 10)),
+        backoff=float(settings.get('couchdb.retry_backoff', 0.1)),
+        max_backoff=float(settings.get('couchdb.retry_max_backoff', 5)),
+    )
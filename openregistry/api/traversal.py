@@ -37,6 +37,41 @@ def get_item(parent, key, request):
         return item
 
 
+def get_document(request, doc_id, conditional=None):
+    """
+    Returns raw document by id from the per-worker document cache
+    or from a read replica for safe requests. Documents loaded by other
+    requests are dropped from the cache by ``invalidate_written_documents``.
+
+    ``conditional`` is set when loading the document the request is about,
+    so its ``If-None-Match``/``If-Match`` headers are checked against the
+    document revision before any model is built. By default that is the
+    document whose id is in the route, such as ``asset_id``.
+    """
+    if conditional is None:
+        conditional = doc_id in (request.matchdict or {}).values()
+    registry = request.registry
+    db = request.read_db
+    cache = getattr(registry, 'document_cache', None)
+    if cache is None or db is not registry.db:
+        # the cache is invalidated by the primary changes feed,
+        # documents read from replicas are not cached
+        doc = db.get(doc_id)
+    elif request.method in ('GET', 'HEAD'):
+        watcher = getattr(registry, 'changes_watcher', None)
+        trusted = watcher is not None and watcher.running and not watcher.failures
+        doc = cache.load(registry.db, doc_id, trusted)
+    else:
+        # the document may be written by this request, it is always checked
+        # and dropped from the cache once the response is ready
+        request.__dict__.setdefault('written_documents', set()).add(doc_id)
+        doc = cache.load(registry.db, doc_id)
+    if conditional and doc is not None:
+        from openregistry.api.utils import check_conditional_request
+        check_conditional_request(request, doc['_rev'])
+    return doc
+
+
 def factory(request):
     root = Root(request)
     return root
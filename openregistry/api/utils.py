@@ -9,27 +9,38 @@ from binascii import hexlify, unhexlify
 from Crypto.Cipher import AES
 from cornice.util import json_error
 from cornice.resource import view
+from webob.etag import AnyETag
 from webob.multidict import NestedMultiDict
 from pkg_resources import iter_entry_points
 from urlparse import urlparse, parse_qs, urlunsplit, parse_qsl
 from time import time as ttime
+from math import isinf, isnan
 from urllib import quote, unquote, urlencode
 from base64 import b64encode, b64decode
-from hashlib import sha512
+from hashlib import sha1, sha512
 from rfc6266 import build_header
 from jsonpointer import resolve_pointer
+from iso8601 import ParseError
 
 from schematics.types import StringType
-from jsonpatch import make_patch, apply_patch as _apply_patch
+from jsonpatch import apply_patch as _apply_patch
 
-import simplejson
 import couchdb
 from pyramid.compat import text_
-from decimal import Decimal
+from pyramid.httpexceptions import HTTPNotModified
+from pyramid.response import Response
 
+from openregistry.api.codec import default_codec, registry_codec
 from openregistry.api.events import ErrorDesctiptorEvent
-from openregistry.api.constants import LOGGER, TZ, ROUTE_PREFIX
+from openregistry.api.constants import (
+    LOGGER, TZ, ROUTE_PREFIX, STREAM_CHUNK_SIZE, STREAM_FORMATS
+)
 from openregistry.api.interfaces import IContentConfigurator
+from openregistry.api.design import is_pending
+from openregistry.api.traversal import get_document
+from openregistry.api.listing import Cursor, cursor_secret, iter_view_chunks, plan_view, skip_key
+from openregistry.api.models.dates import parse_date
+from openregistry.api.revisions import count_revisions, get_revisions, get_state
 
 
 json_view = partial(view, renderer='json')
@@ -71,6 +82,84 @@ def generate_id():
     return uuid4().hex
 
 
+def pointer(basepath, key):
+    return u'{}/{}'.format(basepath, unicode(key).replace(u'~', u'~0').replace(u'/', u'~1'))
+
+
+def list_item_key(item):
+    return item.get('id') if isinstance(item, dict) else None
+
+
+def kept_keys(src_keys, dst_keys):
+    """
+    Ids found in both lists if all ids are unique scalars in the same order
+    in both of them, otherwise None. Ids come from request bodies that are
+    not validated yet, so they may be of any type.
+    """
+    if not all([isinstance(i, (basestring, int, long)) for i in src_keys + dst_keys]):
+        return None
+    keys = set(src_keys)
+    kept = set(dst_keys) & keys
+    if (len(keys) == len(src_keys) and len(set(dst_keys)) == len(dst_keys) and
+            [i for i in src_keys if i in kept] == [i for i in dst_keys if i in kept]):
+        return kept
+    return None
+
+
+def diff_list(changes, src, dst, basepath):
+    common = min(len(src), len(dst))
+    start = 0
+    while start < common and list_item_key(src[start]) == list_item_key(dst[start]):
+        diff_data(changes, src[start], dst[start], pointer(basepath, start))
+        start += 1
+    src_keys = [list_item_key(i) for i in src[start:]]
+    dst_keys = [list_item_key(i) for i in dst[start:]]
+    kept = kept_keys(src_keys, dst_keys)
+    if kept is not None:
+        # objects with unique ids in the same order: removed and added ones are found by id
+        for i in reversed(range(len(src_keys))):
+            if src_keys[i] not in kept:
+                changes.append({'op': 'remove', 'path': pointer(basepath, start + i)})
+        kept_items = iter([i for i in src[start:] if list_item_key(i) in kept])
+        for i, item in enumerate(dst[start:], start):
+            if list_item_key(item) in kept:
+                diff_data(changes, next(kept_items), item, pointer(basepath, i))
+            else:
+                changes.append({'op': 'add', 'path': pointer(basepath, i), 'value': item})
+        return
+    for i in range(start, common):
+        diff_data(changes, src[i], dst[i], pointer(basepath, i))
+    for i in reversed(range(common, len(src))):
+        changes.append({'op': 'remove', 'path': pointer(basepath, i)})
+    for i in range(common, len(dst)):
+        changes.append({'op': 'add', 'path': pointer(basepath, i), 'value': dst[i]})
+
+
+def diff_data(changes, src, dst, basepath=''):
+    """
+    Appends to ``changes`` JSON patch operations turning ``src`` into ``dst``.
+
+    Unlike ``jsonpatch.make_patch`` it walks both values once and emits only
+    add, remove and replace operations. Objects in lists are matched by ``id``,
+    so removing or inserting one does not rewrite the following ones.
+    """
+    if src is dst:
+        return
+    if isinstance(src, dict) and isinstance(dst, dict):
+        for key in src:
+            if key not in dst:
+                changes.append({'op': 'remove', 'path': pointer(basepath, key)})
+        for key, value in dst.items():
+            if key in src:
+                diff_data(changes, src[key], value, pointer(basepath, key))
+            else:
+                changes.append({'op': 'add', 'path': pointer(basepath, key), 'value': value})
+    elif isinstance(src, list) and isinstance(dst, list):
+        diff_list(changes, src, dst, basepath)
+    elif src != dst:
+        changes.append({'op': 'replace', 'path': basepath, 'value': dst})
+
+
 def prepare_patch(changes, orig, patch, basepath=''):
     if isinstance(patch, dict):
         for i in patch:
@@ -88,9 +177,7 @@ def prepare_patch(changes, orig, patch, basepath=''):
             else:
                 changes.append({'op': 'add', 'path': '{}/{}'.format(basepath, i), 'value': j})
     else:
-        for x in make_patch(orig, patch).patch:
-            x['path'] = '{}{}'.format(basepath, x['path'])
-            changes.append(x)
+        diff_data(changes, orig, patch, basepath)
 
 
 def apply_data_patch(item, changes):
@@ -127,7 +214,9 @@ def prepare_revision(item, patch, author):
 
 
 def get_revision_changes(dst, src):
-    return make_patch(dst, src).patch
+    changes = []
+    diff_data(changes, dst, src)
+    return changes
 
 
 def set_ownership(item, request):
@@ -307,6 +396,48 @@ def update_document_url(request, document, document_route, route_kwargs):
     return document
 
 
+def get_etag(rev, path, query='', groups=()):
+    """
+    Strong ETag of a document revision representation: the version tag of
+    the revision at ``path`` and, if the representation depends on ``query``
+    options or user ``groups``, a variant tag after a dot.
+    """
+    etag = sha1(u'\0'.join([rev, path]).encode('utf-8')).hexdigest()
+    if query or groups:
+        etag = '{}.{}'.format(etag, sha1(u'\0'.join([query] + list(groups)).encode('utf-8')).hexdigest()[:16])
+    return etag
+
+
+def request_etag(request, rev):
+    """
+    ETag of the representation at the request path, varying with the user
+    groups and the ``opt_`` query options such as ``opt_pretty``.
+    """
+    groups = sorted([i for i in request.effective_principals if i.startswith('g:')])
+    options = urlencode(sorted([(i, j) for i, j in request.GET.items() if i.startswith('opt_')]))
+    return get_etag(rev, request.path_info, options, groups)
+
+
+def check_conditional_request(request, rev):
+    """
+    Answers ``If-None-Match`` of safe requests with 304 Not Modified and
+    checks ``If-Match`` of PATCH requests against the document revision.
+    ``If-Match`` compares version tags only, so ETags of any representation
+    of the current revision match.
+    """
+    if request.method in ('GET', 'HEAD'):
+        etag = request_etag(request, rev)
+        if etag in request.if_none_match:
+            raise HTTPNotModified(headers={'ETag': '"{}"'.format(etag)})
+        request.response_etag = etag
+    elif request.method == 'PATCH' and request.if_match is not AnyETag:
+        version = get_etag(rev, request.path_info)
+        if version not in [i.split('.', 1)[0] for i in request.if_match.etags]:
+            request.errors.add('header', 'If-Match', 'Precondition Failed')
+            request.errors.status = 412
+            raise error_handler(request)
+
+
 def forbidden(request):
     request.errors.add('url', 'permission', 'Forbidden')
     request.errors.status = 403
@@ -340,13 +471,171 @@ class APIResource(object):
         self.server_id = request.registry.server_id
         self.LOGGER = getLogger(type(self).__module__)
 
+    def get_document(self, doc_id):
+        return get_document(self.request, doc_id)
+
+
+class APIResourceRevisions(APIResource):
+    """
+    History of the resource in ``context``: its revisions paginated with
+    ``offset`` and ``limit``, or its state as of the ``rev`` CouchDB revision
+    or as of ``date``.
+    Plugins register it for their resources and grant ``view_revisions``.
+    """
+
+    def load(self, doc_id):
+        return self.get_document(doc_id)
+
+    @json_view(permission='view_revisions')
+    def get(self):
+        rev = self.request.params.get('rev')
+        date = self.request.params.get('date')
+        if rev or date:
+            name = 'rev' if rev else 'date'
+            if date and not rev:
+                try:
+                    date = parse_date(date)
+                except ParseError:
+                    self.request.errors.add('querystring', 'date', 'Could not parse {}. Should be ISO8601.'.format(date))
+                    self.request.errors.status = 422
+                    raise error_handler(self.request)
+            store = getattr(self.request.registry, 'revision_store', None)
+            try:
+                state = get_state(self.context, self.load, rev or None, date or None,
+                                  store.snapshot_interval if store else 0)
+            except KeyError:
+                state = None
+            if state is None:
+                self.request.errors.add('querystring', name, 'Not Found')
+                self.request.errors.status = 404
+                raise error_handler(self.request)
+            return {'data': state}
+        offset = self.request.params.get('offset', '')
+        offset = int(offset) if offset.isdigit() else 0
+        limit = self.request.params.get('limit', '')
+        limit = int(limit) if limit.isdigit() and 1000 >= int(limit) > 0 else 100
+        revisions = get_revisions(self.context, self.load, offset, limit)
+        params = {'offset': offset + len(revisions), 'limit': limit}
+        return {
+            'data': revisions,
+            'total': count_revisions(self.context),
+            'next_page': {
+                'offset': params['offset'],
+                'path': self.request.current_route_path(_query=params),
+                'uri': self.request.current_route_url(_query=params),
+            }
+        }
+
 
 class APIResourceListing(APIResource):
+    PROJECTIONS = {}
 
     def __init__(self, request, context):
         super(APIResourceListing, self).__init__(request, context)
         self.server = request.registry.couchdb_server
         self.update_after = request.registry.update_after
+        self.cursor_secret = cursor_secret(self.server, self.db)
+
+    def get_cursor(self, offset, changes, mode, feed, descending):
+        """
+        Returns cursor to resume the listing from.
+
+        Besides cursors issued by this listing, plain dateModified offsets and
+        encrypted changes feed offsets of earlier API versions are accepted.
+        """
+        cursor = Cursor.decode(offset, self.cursor_secret)
+        if cursor is not None and cursor.matches(mode, feed, descending):
+            return cursor
+        if cursor is None and changes:
+            seq = decrypt(self.server.uuid, self.db.name, offset)
+            if seq and seq.isdigit():
+                return Cursor(int(seq) + (-1 if descending else 1), None, mode, feed, descending)
+        elif cursor is None:
+            return Cursor(offset, None, mode, feed, descending)
+        self.request.errors.add('querystring', 'offset', 'Offset expired/invalid')
+        self.request.errors.status = 404
+        raise error_handler(self.request)
+
+    def serialize_row(self, row, view_fields, changes, include_docs):
+        if include_docs:
+            return self.serialize_func(self.request, row[u'doc'], view_fields)
+        if view_fields:
+            extra = [('id', row.id)] if changes else [('id', row.id), ('dateModified', row.key)]
+            return dict([(i, j) for i, j in row.value.items() + extra if i in view_fields])
+        if changes:
+            return {'id': row.id, 'dateModified': row.value['dateModified']}
+        return {'id': row.id, 'dateModified': row.key}
+
+    def stream(self, stream, view, view_fields, changes, include_docs, mode, feed, descending, offset):
+        """
+        Streams all objects of the listing starting from ``offset``.
+
+        ``ndjson`` stream writes newline-delimited JSON while the view is read
+        chunk by chunk, the last line holds ``next_page`` offset. ``sse`` is a
+        continuous event stream of the changes feed: after the view is drained
+        it waits for new changes, sending heartbeats in between.
+        """
+        if stream not in STREAM_FORMATS:
+            self.request.errors.add('querystring', 'stream', 'Stream format not supported')
+            self.request.errors.status = 422
+            raise error_handler(self.request)
+        if stream == 'sse' and (not changes or descending):
+            self.request.errors.add('querystring', 'stream', 'Event stream is available only for ascending changes feed')
+            self.request.errors.status = 422
+            raise error_handler(self.request)
+        application_url = self.request.application_url
+        chunk_size = STREAM_CHUNK_SIZE / 10 if include_docs else STREAM_CHUNK_SIZE
+        encode = registry_codec(self.request.registry).dumps
+
+        def serialize(row):
+            item = self.serialize_row(row, view_fields, changes, include_docs)
+            fix_url(item, application_url)
+            return encode(item)
+
+        def iter_ndjson():
+            next_offset = offset
+            for rows in iter_view_chunks(view, chunk_size, descending):
+                yield ''.join(['{}\n'.format(serialize(row)) for row in rows])
+                next_offset = Cursor(rows[-1].key, rows[-1].id, mode, feed, descending).encode(self.cursor_secret)
+            yield encode({'next_page': {'offset': next_offset}}) + '\n'
+
+        def iter_events():
+            watcher = self.request.registry.changes_watcher
+            params = {}
+            while True:
+                since = watcher.start()
+                for rows in iter_view_chunks(view, chunk_size, descending, params):
+                    events = []
+                    for row in rows:
+                        cursor = Cursor(row.key, row.id, mode, feed, descending)
+                        events.append('id: {}\ndata: {}\n\n'.format(cursor.encode(self.cursor_secret), serialize(row)))
+                    yield ''.join(events)
+                    params = cursor.view_params()
+                if not watcher.wait(since, self.request.registry.longpoll_timeout):
+                    yield ':\n\n'
+
+        app_iter = iter_events() if stream == 'sse' else iter_ndjson()
+        return Response(content_type=STREAM_FORMATS[stream], charset='utf-8', app_iter=app_iter)
+
+    def longpoll(self, view, limit, since, view_fields, changes, include_docs):
+        """ Waits for rows of the changes feed to appear after ``since`` """
+        watcher = self.request.registry.changes_watcher
+        timeout = self.request.registry.longpoll_timeout
+        try:
+            requested = float(self.request.params.get('timeout', timeout))
+        except ValueError:
+            requested = timeout
+        if not isnan(requested) and not isinf(requested):
+            timeout = min(max(requested, 0), timeout)
+        deadline = ttime() + timeout
+        results = []
+        while not results and watcher.wait(since, max(deadline - ttime(), 0)):
+            since = watcher.last_seq
+            results = [
+                (self.serialize_row(i, view_fields, changes, include_docs), i.key, i.id)
+                for i in view(limit=limit)
+            ]
+        return results
 
     @json_view(permission='view_listing')
     def get(self):
@@ -365,6 +654,9 @@ class APIResourceListing(APIResource):
         limit = int(limit) if limit.isdigit() and (100 if fields else 1000) >= int(limit) > 0 else 100
         descending = bool(self.request.params.get('descending'))
         offset = self.request.params.get('offset', '')
+        stream = self.request.params.get('stream', '')
+        if not offset and stream == 'sse':
+            offset = self.request.headers.get('Last-Event-ID', '')
         if descending:
             params['descending'] = 1
         else:
@@ -375,67 +667,62 @@ class APIResourceListing(APIResource):
         if feed and feed in self.FEED:
             params['feed'] = feed
             pparams['feed'] = feed
+        else:
+            feed = u''
         mode = self.request.params.get('mode', '')
         if mode and mode in view_map:
             params['mode'] = mode
             pparams['mode'] = mode
-        view_limit = limit + 1 if offset else limit
-        if changes:
-            if offset:
-                view_offset = decrypt(self.server.uuid, self.db.name, offset)
-                if view_offset and view_offset.isdigit():
-                    view_offset = int(view_offset)
-                else:
-                    self.request.errors.add('querystring', 'offset', 'Offset expired/invalid')
-                    self.request.errors.status = 404
-                    raise error_handler(self.request)
-            if not offset:
-                view_offset = 'now' if descending else 0
         else:
-            if offset:
-                view_offset = offset
-            else:
-                view_offset = '9' if descending else ''
-        list_view = view_map.get(mode, view_map[u''])
-        if self.update_after:
-            view = partial(list_view, self.db, limit=view_limit, startkey=view_offset, descending=descending, stale='update_after')
+            mode = u''
+        longpoll = changes and bool(self.request.params.get('longpoll'))
+        if longpoll:
+            params['longpoll'] = 1
+        if offset:
+            cursor = self.get_cursor(offset, changes, mode, feed, descending)
+            view_params = cursor.view_params()
         else:
-            view = partial(list_view, self.db, limit=view_limit, startkey=view_offset, descending=descending)
+            cursor = None
+            view_params = {'startkey': ('now' if descending else 0) if changes else ('9' if descending else '')}
+        if self.update_after and not longpoll and stream != 'sse':
+            view_params['stale'] = 'update_after'
+        list_view = view_map.get(mode, view_map[u''])
+        include_docs = False
         if fields:
-            if not changes and set(fields).issubset(set(self.FIELDS)):
-                results = [
-                    (dict([(i, j) for i, j in x.value.items() + [('id', x.id), ('dateModified', x.key)] if i in view_fields]), x.key)
-                    for x in view()
-                ]
-            elif changes and set(fields).issubset(set(self.FIELDS)):
-                results = [
-                    (dict([(i, j) for i, j in x.value.items() + [('id', x.id)] if i in view_fields]), x.key)
-                    for x in view()
-                ]
-            elif fields:
-                self.LOGGER.info('Used custom fields for {} list: {}'.format(self.object_name_for_listing, ','.join(sorted(fields))),
-                            extra=context_unpack(self.request, {'MESSAGE_ID': self.log_message_id}))
-
-                results = [
-                    (self.serialize_func(self.request, i[u'doc'], view_fields), i.key)
-                    for i in view(include_docs=True)
-                ]
-        else:
-            results = [
-                ({'id': i.id, 'dateModified': i.value['dateModified']} if changes else {'id': i.id, 'dateModified': i.key}, i.key)
-                for i in view()
-            ]
+            projections = self.PROJECTIONS.get(u'changes' if changes else u'dateModified', {}).get(mode, [])
+            projections = [i for i in projections if not is_pending(i[1])]
+            planned_view = plan_view(fields, list_view, self.FIELDS, projections)
+            include_docs = planned_view is None
+            list_view = planned_view or list_view
+        # changes feed keys are local sequence numbers of the primary database
+        db = self.db if changes else self.request.read_db
+        view = partial(list_view, db, descending=descending, **view_params)
+        if include_docs:
+            self.LOGGER.info('Used custom fields for {} list: {}'.format(self.object_name_for_listing, ','.join(sorted(fields))),
+                        extra=context_unpack(self.request, {'MESSAGE_ID': self.log_message_id}))
+            view = partial(view, include_docs=True)
+        if cursor is not None and cursor.docid is None and not changes:
+            # plain dateModified offset of earlier API versions
+            view = skip_key(view, cursor.key, descending)
+        if not fields:
+            view_fields = None
+        if stream:
+            return self.stream(stream, view, view_fields, changes, include_docs, mode, feed, descending, offset)
+        if longpoll:
+            since = self.request.registry.changes_watcher.start()
+        results = [
+            (self.serialize_row(i, view_fields, changes, include_docs), i.key, i.id)
+            for i in view(limit=limit)
+        ]
+        if longpoll and not results:
+            results = self.longpoll(view, limit, since, view_fields, changes, include_docs)
         if results:
-            params['offset'], pparams['offset'] = results[-1][1], results[0][1]
-            if offset and view_offset == results[0][1]:
-                results = results[1:]
-            elif offset and view_offset != results[0][1]:
-                results = results[:limit]
-                params['offset'], pparams['offset'] = results[-1][1], view_offset
+            params['offset'] = Cursor(results[-1][1], results[-1][2], mode, feed, descending).encode(self.cursor_secret)
+            pparams['offset'] = Cursor(results[0][1], results[0][2], mode, feed, not descending).encode(self.cursor_secret)
             results = [i[0] for i in results]
-            if changes:
-                params['offset'] = encrypt(self.server.uuid, self.db.name, params['offset'])
-                pparams['offset'] = encrypt(self.server.uuid, self.db.name, pparams['offset'])
+        elif cursor is not None and cursor.docid is not None:
+            params['offset'] = offset
+            pparams['offset'] = cursor.reverse().encode(self.cursor_secret)
         else:
             params['offset'] = offset
             pparams['offset'] = offset
@@ -481,7 +768,7 @@ def serialize_document_url(document):
     request = root.request
     if not request.registry.docservice_url:
         return url
-    if 'status' in parents[0] and parents[0].status in type(parents[0])._options.roles:
+    if 'status' in parents[0] and parents[0].status in type(parents[0])._meta.roles:
         role = parents[0].status
         for index, obj in enumerate(parents):
             if obj.id != url.split('/')[(index - len(parents)) * 2 - 1]:
@@ -489,8 +776,7 @@ def serialize_document_url(document):
             field = url.split('/')[(index - len(parents)) * 2]
             if "_" in field:
                 field = field[0] + field.title().replace("_", "")[1:]
-            roles = type(obj)._options.roles
-            if roles[role if role in roles else 'default'](field, []):
+            if type(obj)._meta.is_hidden(role, field, []):
                 return url
     if not document.hash:
         path = [i for i in urlparse(url).path.split('/') if len(i) == 32 and not set(i).difference(hexdigits)]
@@ -499,15 +785,30 @@ def serialize_document_url(document):
 
 
 def json_body(self):
-    return simplejson.loads(text_(self.body, self.charset), parse_float = Decimal)
+    return registry_codec(self.registry).loads(text_(self.body, self.charset))
+
+
+def json_body_lookup(request, key):
+    """
+    Returns JSON body of the request if it may have ``key`` or None.
 
+    Only JSON requests are parsed and a plain scan of the body for the quoted
+    key goes first, so requests without it are not parsed here at all. The
+    parsed body is the reified ``json_body`` shared with validation.
+    """
+    if request.content_type != 'application/json' or '"{}"'.format(key) not in request.body:
+        return None
+    try:
+        json = request.json_body
+    except ValueError:
+        return None
+    return json if isinstance(json, dict) else None
 
-def couchdb_json_decode():
-    my_encode = lambda obj, dumps=simplejson.dumps: dumps(obj, allow_nan=False, ensure_ascii=False)
 
+def couchdb_json_decode(codec=default_codec):
     def my_decode(string_):
         if isinstance(string_, couchdb.util.btype):
             string_ = string_.decode('utf-8')
-        return simplejson.loads(string_, parse_float=Decimal)
+        return codec.loads(string_)
 
-    couchdb.json.use(decode=my_decode, encode=my_encode)
+    couchdb.json.use(decode=my_decode, encode=codec.dumps_document)
@@ -1,4 +1,7 @@
-from schematics.exceptions import ModelValidationError, ModelConversionError
+from copy import copy
+from schematics.exceptions import BaseError, ModelValidationError, ModelConversionError
+from schematics.transforms import export_loop
+from schematics.validate import validate
 from openregistry.api.constants import (
     DOCUMENT_BLACKLISTED_FIELDS,
     DOCUMENT_WHITELISTED_FIELDS
@@ -25,11 +28,66 @@ def validate_json_data(request):
     return json['data']
 
 
+def primitive_converter(field, value):
+    return field.to_primitive(value)
+
+
+def serialize_fields(model_instance, names):
+    """ Serializes only ``names`` fields of the model instance """
+    cls = type(model_instance)
+    values = dict.fromkeys(list(cls._fields) + list(cls._serializables))
+    values.update([(i, model_instance._data.get(i)) for i in names if i in cls._fields])
+    return export_loop(cls, values, primitive_converter) or {}
+
+
+def validate_fields(model_instance, names):
+    """
+    Validates ``names`` fields of the model instance, values of other
+    fields are trusted and only passed to model level validators.
+    """
+    cls = type(model_instance)
+    data = model_instance._data
+    try:
+        validated = validate(
+            cls,
+            dict([(i, data[i]) for i in names]),
+            context=dict([(i, j) for i, j in data.items() if i not in names])
+        )
+    except BaseError, e:
+        raise ModelValidationError(e.messages)
+    data.update(validated)
+
+
+def patch_model(context, data):
+    """
+    Returns a copy of ``context`` model with ``data`` patch applied and
+    validated. Only patched top level fields are converted and validated
+    again, the rest of the copy shares values with ``context``.
+    """
+    model = type(context)
+    initial_data = serialize_fields(context, data)
+    new_patch = apply_data_patch(initial_data, data)
+    m = copy(context)
+    m._data = dict(context._data)
+    names = set(new_patch) & set(model._fields)
+    if new_patch:
+        m.import_data(new_patch, partial=True, strict=True)
+        # conversion fills fields missing from the patch with their defaults
+        m._data.update([(i, j) for i, j in context._data.items() if i not in names])
+    m.__parent__ = context.__parent__
+    validate_fields(m, names)
+    return m
+
+
 def validate_data(request, model, partial=False, data=None):
     if data is None:
         data = validate_json_data(request)
     try:
-        if partial and isinstance(request.context, model):
+        if partial and type(request.context) is model:
+            m = patch_model(request.context, data)
+            role = request.context.get_role()
+            method = m.to_patch
+        elif partial and isinstance(request.context, model):
             initial_data = request.context.serialize()
             m = model(initial_data)
             new_patch = apply_data_patch(initial_data, data)
@@ -113,7 +171,7 @@ def validate_document_data(request, error_handler, **kwargs):
     check_document(request, document, 'body')
 
     if first_document:
-        for attr_name in type(first_document)._fields:
+        for attr_name in type(first_document)._meta.fields:
             if attr_name in DOCUMENT_WHITELISTED_FIELDS:
                 setattr(document, attr_name, getattr(first_document, attr_name))
             elif attr_name not in DOCUMENT_BLACKLISTED_FIELDS and attr_name not in request.validated['json_data']:
@@ -3,6 +3,9 @@ from cornice.service import Service
 from pyramid.response import Response
 
 health = Service(name='health', path='/health', renderer='json')
+changes_health = Service(name='changes_health', path='/health/changes', renderer='json')
+cache_health = Service(name='cache_health', path='/health/cache', renderer='json')
+replicas_health = Service(name='replicas_health', path='/health/replicas', renderer='json')
 HEALTH_THRESHOLD_FUNCTIONS = {
     'any': any,
     'all': all
@@ -25,3 +28,29 @@ def get_health(request):
     )):
         return Response(json_body=output, status=503)
     return output
+
+
+@changes_health.get()
+def get_changes_health(request):
+    watcher = request.registry.changes_watcher
+    output = watcher.stats()
+    if not output['running'] or output['lag'] > request.registry.health_threshold:
+        return Response(json_body=output, status=503)
+    return output
+
+
+@cache_health.get()
+def get_cache_health(request):
+    cache = getattr(request.registry, 'document_cache', None)
+    return cache.stats() if cache is not None else {}
+
+
+@replicas_health.get()
+def get_replicas_health(request):
+    router = getattr(request.registry, 'replica_router', None)
+    if router is None:
+        return {}
+    output = router.stats()
+    if not router.healthy:
+        return Response(json_body=output, status=503)
+    return output